@@ -55,7 +55,7 @@ from rucio.common.exception import (RucioException, RSEBlacklisted, DataIdentifi
                                     DataIdentifierNotFound, NoFilesUploaded, NotAllFilesUploaded, FileReplicaAlreadyExists,
                                     ResourceTemporaryUnavailable, ServiceUnavailable, InputValidationError, RSEChecksumUnavailable,
                                     ScopeNotFound)
-from rucio.common.utils import (adler32, detect_client_location, execute, generate_uuid, make_valid_did, md5, send_trace,
+from rucio.common.utils import (adler32_and_md5, detect_client_location, execute, generate_uuid, make_valid_did, send_trace,
                                 retry, GLOBALLY_SUPPORTED_CHECKSUMS)
 from rucio.rse import rsemanager as rsemgr
 from rucio import version
@@ -461,8 +461,7 @@ class UploadClient:
         new_item['basename'] = os.path.basename(filepath)
 
         new_item['bytes'] = os.stat(filepath).st_size
-        new_item['adler32'] = adler32(filepath)
-        new_item['md5'] = md5(filepath)
+        new_item['adler32'], new_item['md5'] = adler32_and_md5(filepath)
         new_item['meta'] = {'guid': self._get_file_guid(new_item)}
         new_item['state'] = 'C'
         if not new_item.get('did_scope'):
@@ -79,7 +79,7 @@ def get_lifetime_policy():
 
 
 def policy_filter(function):
-    mapping = {'atlas': ['get_scratch_policy', 'archive_localgroupdisk_datasets']}
+    mapping = {'atlas': ['get_scratch_policy', 'archive_localgroupdisk_datasets', 'archive_localgroupdisk_datasets_bulk']}
     policy = get_policy()
     if policy in mapping and function.__name__ in mapping[policy]:
         @wraps(function)
@@ -276,6 +276,7 @@ GLOBALLY_SUPPORTED_CHECKSUMS = ['adler32', 'md5']
 CHECKSUM_ALGO_DICT = {}
 PREFERRED_CHECKSUM = GLOBALLY_SUPPORTED_CHECKSUMS[0]
 CHECKSUM_KEY = 'supported_checksums'
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
 
 
 def is_checksum_valid(checksum_name):
@@ -310,9 +311,10 @@ def adler32(file):
     adler = 1
 
     try:
+        # Read fixed size blocks, iterating over lines gives arbitrarily small or large chunks for binary files
         with open(file, 'rb') as openFile:
-            for line in openFile:
-                adler = zlib.adler32(line, adler)
+            for block in iter(lambda: openFile.read(CHECKSUM_BLOCK_SIZE), b''):
+                adler = zlib.adler32(block, adler)
     except Exception as e:
         raise Exception('FATAL - could not get Adler32 checksum of file %s - %s' % (file, e))
 
@@ -346,6 +348,30 @@ def md5(file):
 CHECKSUM_ALGO_DICT['md5'] = md5
 
 
+def adler32_and_md5(file):
+    """
+    Computes the Adler32 and the MD5 checksums of a file with a single read of its content
+
+    :param file: file name
+    :returns: A tuple with the same strings as returned by adler32 and md5.
+    """
+    adler = 1
+    hash_md5 = hashlib.md5()
+    try:
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b''):
+                adler = zlib.adler32(block, adler)
+                hash_md5.update(block)
+    except Exception as e:
+        raise Exception('FATAL - could not get Adler32 and MD5 checksums of file %s - %s' % (file, e))
+
+    # backflip on 32bit
+    if adler < 0:
+        adler = adler + 2 ** 32
+
+    return str('%08x' % adler), hash_md5.hexdigest()
+
+
 def sha256(file):
     """
     Runs the SHA256 algorithm on the binary content of the file named file and returns the hexadecimal digest
@@ -371,8 +397,9 @@ def crc32(file):
     :returns: string of 32 hexadecimal digits
     """
     prev = 0
-    for eachLine in open(file, "rb"):
-        prev = zlib.crc32(eachLine, prev)
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b""):
+            prev = zlib.crc32(block, prev)
     return "%X" % (prev & 0xFFFFFFFF)
 
 
@@ -870,16 +897,21 @@ def get_tmp_dir():
     return base_dir
 
 
+ARCHIVE_SUFFIXES = ('.zip', '.zipx', '.tar.gz', '.tgz', '.tar.z', '.tar.bz2', '.tbz2')
+
+
 def is_archive(name):
     '''
     Check if a file name is an archive file or not.
+    Numbered suffixes, e.g. file.tar.gz.1, are ignored.
 
     :return: A boolean.
     '''
-    regexp = r'^.*\.(zip|zipx|tar.gz|tgz|tar.Z|tar.bz2|tbz2)(\.\d+)*$'
-    if re.match(regexp, name, re.I):
-        return True
-    return False
+    head, sep, tail = name.rpartition('.')
+    while sep and tail.isdigit():
+        name = head
+        head, sep, tail = name.rpartition('.')
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
 
 
 class Color:
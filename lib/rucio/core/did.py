@@ -37,30 +37,132 @@
 
 import logging
 import random
+import re
 from datetime import datetime, timedelta
 from enum import Enum
-from hashlib import md5
 from re import match
 
 from six import string_types
 from sqlalchemy import and_, or_, exists
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import DatabaseError, IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import not_, func
-from sqlalchemy.sql.expression import bindparam, case, select, true, false
+from sqlalchemy.sql.expression import bindparam, case, literal, select, true, false, tuple_
 
 import rucio.core.replica  # import add_replicas
 import rucio.core.rule
 from rucio.common import exception
 from rucio.common.utils import str_to_date, is_archive, chunks
 from rucio.core import did_meta_plugins, config as config_core
-from rucio.core.message import add_message
+from rucio.core.message import add_message, add_messages
 from rucio.core.monitor import record_timer_block, record_counter
 from rucio.core.naming_convention import validate_name
 from rucio.db.sqla import models, filter_thread_work
-from rucio.db.sqla.constants import DIDType, DIDReEvaluation, DIDAvailability, RuleState
+from rucio.db.sqla.constants import DIDType, DIDReEvaluation, DIDAvailability, RuleState, RuleNotification
 from rucio.db.sqla.session import read_session, transactional_session, stream_session
 
+# Number of keys per IN list of the composite key lookups, e.g. on (scope, name)
+KEY_CHUNK_SIZE = 100
+
+# IntegrityError messages of the supported database backends, compiled once at import time
+DID_DUPLICATE_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    '.*IntegrityError.*ORA-00001: unique constraint.*DIDS_PK.*violated.*',
+    '.*IntegrityError.*UNIQUE constraint failed: dids.scope, dids.name.*',
+    '.*IntegrityError.*1062.*Duplicate entry.*for key.*',
+    '.*IntegrityError.*duplicate key value violates unique constraint.*',
+    '.*UniqueViolation.*duplicate key value violates unique constraint.*',
+    '.*IntegrityError.*columns? .*not unique.*'))
+
+DID_SCOPE_NOT_FOUND_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    '.*IntegrityError.*02291.*integrity constraint.*DIDS_SCOPE_FK.*violated - parent key not found.*',
+    '.*IntegrityError.*FOREIGN KEY constraint failed.*',
+    '.*IntegrityError.*1452.*Cannot add or update a child row: a foreign key constraint fails.*',
+    '.*IntegrityError.*insert or update on table.*violates foreign key constraint.*',
+    '.*ForeignKeyViolation.*insert or update on table.*violates foreign key constraint.*',
+    '.*IntegrityError.*foreign key constraints? failed.*'))
+
+# The touch_dids UPDATE is built once and its compiled form is cached per dialect, kronos issues it for every dataset
+TOUCH_DIDS_STMT = models.DataIdentifier.__table__.update().\
+    where(and_(models.DataIdentifier.scope == bindparam('b_scope'),
+               models.DataIdentifier.name == bindparam('b_name'),
+               models.DataIdentifier.did_type == bindparam('b_did_type'))).\
+    values(accessed_at=bindparam('b_accessed_at'),
+           access_cnt=case([(models.DataIdentifier.access_cnt.is_(None), 1)],
+                           else_=(models.DataIdentifier.access_cnt + 1)))
+COMPILED_CACHE = {}
+
+# Columns copied by insert_deleted_dids, derived from the models so that new DID columns are archived as well.
+# deleted_at is set to the deletion time, created_at and updated_at are filled by the model defaults.
+DELETED_DID_COLUMNS = [column.name for column in models.DataIdentifier.__table__.columns
+                       if column.name in models.DeletedDataIdentifier.__table__.columns
+                       and column.name not in ('deleted_at', 'created_at', 'updated_at')]
+DELETED_DID_SELECT_COLUMNS = [models.DataIdentifier.__table__.columns[column] for column in DELETED_DID_COLUMNS]
+
+CONTENT_CHILD_NOT_FOUND_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    '.*IntegrityError.*ORA-02291: integrity constraint .*CONTENTS_CHILD_ID_FK.*violated - parent key not found.*',
+    '.*IntegrityError.*1452.*Cannot add or update a child row: a foreign key constraint fails.*',
+    '.*IntegrityError.*foreign key constraints? failed.*',
+    '.*IntegrityError.*insert or update on table.*violates foreign key constraint.*'))
+
+FILE_CONTENT_DUPLICATE_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    '.*IntegrityError.*ORA-00001: unique constraint .*CONTENTS_PK.*violated.*',
+    '.*IntegrityError.*UNIQUE constraint failed: contents.scope, contents.name, contents.child_scope, contents.child_name.*',
+    '.*IntegrityError.*duplicate key value violates unique constraint.*',
+    '.*UniqueViolation.*duplicate key value violates unique constraint.*',
+    '.*IntegrityError.*1062.*Duplicate entry .*for key.*PRIMARY.*',
+    '.*duplicate entry.*key.*PRIMARY.*',
+    '.*IntegrityError.*columns? .*not unique.*'))
+
+COLLECTION_CONTENT_DUPLICATE_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    '.*IntegrityError.*ORA-00001: unique constraint .*CONTENTS_PK.*violated.*',
+    '.*IntegrityError.*1062.*Duplicate entry .*for key.*PRIMARY.*',
+    '.*IntegrityError.*columns? scope.*name.*child_scope.*child_name.*not unique.*',
+    '.*IntegrityError.*duplicate key value violates unique constraint.*',
+    '.*UniqueViolation.*duplicate key value violates unique constraint.*',
+    '.*IntegrityError.* UNIQUE constraint failed: contents.scope, contents.name, contents.child_scope, contents.child_name.*'))
+
+
+def _matches_any(patterns, message):
+    """
+    Check if an error message matches any of the given compiled patterns.
+
+    :param patterns: Tuple of compiled regular expressions.
+    :param message: The error message.
+    :returns: True if one of the patterns matches, False otherwise.
+    """
+    return any(pattern.match(message) for pattern in patterns)
+
+
+def _supports_recursive_cte(session):
+    """
+    Check if the database backend supports recursive common table expressions.
+    MySQL only supports them from version 8 on.
+
+    :param session: The database session in use.
+    :returns: True if WITH RECURSIVE can be used, False otherwise.
+    """
+    dialect = session.bind.dialect
+    if dialect.name != 'mysql':
+        return True
+    if dialect.server_version_info is None:
+        # The server version is only known once a connection has been made
+        session.connection()
+    return dialect.server_version_info >= (8,)
+
+
+def _composite_key_clauses(columns, keys):
+    """
+    Build the IN clauses matching a composite key, e.g. (scope, name), against a list of keys.
+    The keys are split in chunks of KEY_CHUNK_SIZE to bound the bind parameters per statement.
+
+    :param columns: The columns of the composite key.
+    :param keys: List of key tuples, with the values in the order of the columns.
+    :returns: Generator of SQL clauses, one per chunk of keys.
+    """
+    for chunk in chunks(keys, KEY_CHUNK_SIZE):
+        yield tuple_(*columns).in_(chunk)
+
 
 @read_session
 def list_expired_dids(worker_number=None, total_workers=None, limit=None, session=None):
@@ -71,6 +173,7 @@ def list_expired_dids(worker_number=None, total_workers=None, limit=None, sessio
     :param session: The database session in use.
     """
 
+    now = datetime.utcnow()
     stmt = exists().where(and_(models.ReplicationRule.scope == models.DataIdentifier.scope,
                                models.ReplicationRule.name == models.DataIdentifier.name,
                                models.ReplicationRule.locked == true()))
@@ -78,26 +181,14 @@ def list_expired_dids(worker_number=None, total_workers=None, limit=None, sessio
                           models.DataIdentifier.did_type,
                           models.DataIdentifier.created_at,
                           models.DataIdentifier.purge_replicas).\
-        filter(models.DataIdentifier.expired_at < datetime.utcnow(), not_(stmt)).\
+        filter(models.DataIdentifier.expired_at < bindparam('now', value=now), not_(stmt)).\
         order_by(models.DataIdentifier.expired_at).\
         with_hint(models.DataIdentifier, "index(DIDS DIDS_EXPIRED_AT_IDX)", 'oracle')
 
     if session.bind.dialect.name in ['oracle', 'mysql', 'postgresql']:
         query = filter_thread_work(session=session, query=query, total_threads=total_workers, thread_id=worker_number, hash_variable='name')
     elif session.bind.dialect.name == 'sqlite' and worker_number and total_workers and total_workers > 0:
-        row_count = 0
-        dids = list()
-        for scope, name, did_type, created_at, purge_replicas in query.yield_per(10):
-            if int(md5(name).hexdigest(), 16) % total_workers == worker_number:
-                dids.append({'scope': scope,
-                             'name': name,
-                             'did_type': did_type,
-                             'created_at': created_at,
-                             'purge_replicas': purge_replicas})
-                row_count += 1
-            if limit and row_count >= limit:
-                return dids
-        return dids
+        query = query.filter(func.md5_mod(models.DataIdentifier.name, total_workers) == worker_number)
     else:
         if worker_number and total_workers:
             raise exception.DatabaseException('The database type %s returned by SQLAlchemy is invalid.' % session.bind.dialect.name)
@@ -105,8 +196,9 @@ def list_expired_dids(worker_number=None, total_workers=None, limit=None, sessio
     if limit:
         query = query.limit(limit)
 
+    # Execute the Core statement directly to skip the ORM row processing of the Query
     return [{'scope': scope, 'name': name, 'did_type': did_type, 'created_at': created_at,
-             'purge_replicas': purge_replicas} for scope, name, did_type, created_at, purge_replicas in query]
+             'purge_replicas': purge_replicas} for scope, name, did_type, created_at, purge_replicas in session.execute(query.statement)]
 
 
 @transactional_session
@@ -143,6 +235,8 @@ def add_dids(dids, account, session=None):
     :param account: The account owner.
     :param session: The database session in use.
     """
+    messages = []
+    now = datetime.utcnow()
     try:
 
         for did in dids:
@@ -157,7 +251,7 @@ def add_dids(dids, account, session=None):
                 # Lifetime
                 expired_at = None
                 if did.get('lifetime'):
-                    expired_at = datetime.utcnow() + timedelta(seconds=did['lifetime'])
+                    expired_at = now + timedelta(seconds=did['lifetime'])
 
                 # Insert new data identifier
                 new_did = models.DataIdentifier(scope=did['scope'], name=did['name'], account=did.get('account') or account,
@@ -190,30 +284,20 @@ def add_dids(dids, account, session=None):
                     if account.vo != 'def':
                         message['vo'] = account.vo
 
-                    add_message(event_type, message, session=session)
+                    messages.append((event_type, message))
 
             except KeyError:
                 # ToDo
                 raise
 
         session.flush()
+        add_messages(messages, session=session)
 
     except IntegrityError as error:
-        if match('.*IntegrityError.*ORA-00001: unique constraint.*DIDS_PK.*violated.*', error.args[0]) \
-                or match('.*IntegrityError.*UNIQUE constraint failed: dids.scope, dids.name.*', error.args[0]) \
-                or match('.*IntegrityError.*1062.*Duplicate entry.*for key.*', error.args[0]) \
-                or match('.*IntegrityError.*duplicate key value violates unique constraint.*', error.args[0]) \
-                or match('.*UniqueViolation.*duplicate key value violates unique constraint.*', error.args[0]) \
-                or match('.*IntegrityError.*columns? .*not unique.*', error.args[0]):
+        if _matches_any(DID_DUPLICATE_PATTERNS, error.args[0]):
             raise exception.DataIdentifierAlreadyExists('Data Identifier already exists!')
 
-        if match('.*IntegrityError.*02291.*integrity constraint.*DIDS_SCOPE_FK.*violated - parent key not found.*', error.args[0]) \
-                or match('.*IntegrityError.*FOREIGN KEY constraint failed.*', error.args[0]) \
-                or match('.*IntegrityError.*1452.*Cannot add or update a child row: a foreign key constraint fails.*', error.args[0]) \
-                or match('.*IntegrityError.*02291.*integrity constraint.*DIDS_SCOPE_FK.*violated - parent key not found.*', error.args[0]) \
-                or match('.*IntegrityError.*insert or update on table.*violates foreign key constraint.*', error.args[0]) \
-                or match('.*ForeignKeyViolation.*insert or update on table.*violates foreign key constraint.*', error.args[0]) \
-                or match('.*IntegrityError.*foreign key constraints? failed.*', error.args[0]):
+        if _matches_any(DID_SCOPE_NOT_FOUND_PATTERNS, error.args[0]):
             raise exception.ScopeNotFound('Scope not found!')
 
         raise exception.RucioException(error.args)
@@ -243,82 +327,70 @@ def __add_files_to_archive(scope, name, files, account, ignore_duplicate=False,
         filter(models.DataIdentifier.did_type == DIDType.FILE).\
         with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle')
 
-    file_condition = []
-    for file in files:
-        file_condition.append(and_(models.DataIdentifier.scope == file['scope'],
-                                   models.DataIdentifier.name == file['name']))
+    file_keys = [(file['scope'], file['name']) for file in files]
 
-    existing_content, existing_files = [], {}
+    existing_content, existing_files = set(), {}
     if ignore_duplicate:
         # lookup for existing content
-        content_query = session.query(models.ConstituentAssociation.scope,
-                                      models.ConstituentAssociation.name,
-                                      models.ConstituentAssociation.child_scope,
+        content_query = session.query(models.ConstituentAssociation.child_scope,
                                       models.ConstituentAssociation.child_name).\
-            with_hint(models.ConstituentAssociation, "INDEX(ARCHIVE_CONTENTS ARCH_CONTENTS_PK)", 'oracle')
-        content_condition = []
-        for file in files:
-            content_condition.append(and_(models.ConstituentAssociation.scope == scope,
-                                          models.ConstituentAssociation.name == name,
-                                          models.ConstituentAssociation.child_scope == file['scope'],
-                                          models.ConstituentAssociation.child_name == file['name']))
-        for row in content_query.filter(or_(*content_condition)):
-            existing_content.append(row)
-
-    for row in files_query.filter(or_(*file_condition)):
-        existing_files['%s:%s' % (row.scope.internal, row.name)] = {'child_scope': row.scope,
-                                                                    'child_name': row.name,
-                                                                    'scope': scope,
-                                                                    'name': name,
-                                                                    'bytes': row.bytes,
-                                                                    'adler32': row.adler32,
-                                                                    'md5': row.md5,
-                                                                    'guid': row.guid,
-                                                                    'length': row.events}
+            with_hint(models.ConstituentAssociation, "INDEX(ARCHIVE_CONTENTS ARCH_CONTENTS_PK)", 'oracle').\
+            filter_by(scope=scope, name=name)
+        for clause in _composite_key_clauses((models.ConstituentAssociation.child_scope, models.ConstituentAssociation.child_name), file_keys):
+            for row in content_query.filter(clause):
+                existing_content.add((row.child_scope, row.child_name))
+
+    # The archive is the same for all contents, only the constituent fields vary
+    content_template = {'scope': scope, 'name': name}
+    for clause in _composite_key_clauses((models.DataIdentifier.scope, models.DataIdentifier.name), file_keys):
+        for row in files_query.filter(clause):
+            existing_files[row.scope, row.name] = {**content_template,
+                                                   'child_scope': row.scope,
+                                                   'child_name': row.name,
+                                                   'bytes': row.bytes,
+                                                   'adler32': row.adler32,
+                                                   'md5': row.md5,
+                                                   'guid': row.guid,
+                                                   'length': row.events}
 
     contents = []
-    new_files, existing_files_condition = [], []
+    new_files, existing_file_keys = [], []
     for file in files:
-        did_tag = '%s:%s' % (file['scope'].internal, file['name'])
-        if did_tag not in existing_files:
+        existing_file = existing_files.get((file['scope'], file['name']))
+        if existing_file is None:
             # For non existing files
             # Add them to the content
-            contents.append({'child_scope': file['scope'],
+            contents.append({**content_template,
+                             'child_scope': file['scope'],
                              'child_name': file['name'],
-                             'scope': scope,
-                             'name': name,
                              'bytes': file['bytes'],
                              'adler32': file.get('adler32'),
                              'md5': file.get('md5'),
                              'guid': file.get('guid'),
                              'length': file.get('events')})
 
-            file['constituent'] = True
-            file['did_type'] = DIDType.FILE
-            file['account'] = account
-            for key in file.get('meta', {}):
-                file[key] = file['meta'][key]
-            # Prepare new file registrations
-            new_files.append(file)
+            # Prepare new file registrations, the metadata takes precedence
+            new_did = {key: value for key, value in file.items() if key != 'meta'}
+            new_did.update(constituent=True, did_type=DIDType.FILE, account=account)
+            new_did.update(file.get('meta', {}))
+            new_files.append(new_did)
         else:
             # For existing files
             # Prepare the dids updates
-            existing_files_condition.append(and_(models.DataIdentifier.scope == file['scope'],
-                                                 models.DataIdentifier.name == file['name']))
+            existing_file_keys.append((file['scope'], file['name']))
             # Check if they are not already in the content
-            if not existing_content or (scope, name, file['scope'], file['name']) not in existing_content:
-                contents.append(existing_files[did_tag])
+            if (file['scope'], file['name']) not in existing_content:
+                contents.append(existing_file)
 
     # insert into archive_contents
     try:
         new_files and session.bulk_insert_mappings(models.DataIdentifier, new_files)
-        if existing_files_condition:
-            for chunk in chunks(existing_files_condition, 20):
-                session.query(models.DataIdentifier).\
-                    with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').\
-                    filter(models.DataIdentifier.did_type == DIDType.FILE).\
-                    filter(or_(models.DataIdentifier.constituent.is_(None), models.DataIdentifier.constituent == false())).\
-                    filter(or_(*chunk)).update({'constituent': True})
+        for clause in _composite_key_clauses((models.DataIdentifier.scope, models.DataIdentifier.name), existing_file_keys):
+            session.query(models.DataIdentifier).\
+                with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').\
+                filter(models.DataIdentifier.did_type == DIDType.FILE).\
+                filter(or_(models.DataIdentifier.constituent.is_(None), models.DataIdentifier.constituent == false())).\
+                filter(clause).update({'constituent': True}, synchronize_session='fetch')
         contents and session.bulk_insert_mappings(models.ConstituentAssociation, contents)
         session.flush()
     except IntegrityError as error:
@@ -333,17 +405,34 @@ def __add_files_to_archive(scope, name, files, account, ignore_duplicate=False,
         # mark tha archive file as is_archive
         archive_did.is_archive = True
 
-        # mark parent datasets as is_archive = True
-        session.query(models.DataIdentifier).filter(
-            exists(select([1]).prefix_with("/*+ INDEX(CONTENTS CONTENTS_CHILD_SCOPE_NAME_IDX) */", dialect="oracle")).where(
-                and_(models.DataIdentifierAssociation.child_scope == scope,
-                     models.DataIdentifierAssociation.child_name == name,
-                     models.DataIdentifierAssociation.scope == models.DataIdentifier.scope,
-                     models.DataIdentifierAssociation.name == models.DataIdentifier.name))
-        ).filter(
-            or_(models.DataIdentifier.is_archive.is_(None),
-                models.DataIdentifier.is_archive == false())
-        ).update({"is_archive": True}, synchronize_session=False)
+        # mark parent datasets as is_archive = True, if the archive is attached to any
+        is_attached = session.query(models.DataIdentifierAssociation.scope).\
+            with_hint(models.DataIdentifierAssociation, "INDEX(CONTENTS CONTENTS_CHILD_SCOPE_NAME_IDX)", 'oracle').\
+            filter_by(child_scope=scope, child_name=name).\
+            first() is not None
+        if is_attached:
+            if session.bind.dialect.name in ['postgresql', 'mysql']:
+                # Multiple-table UPDATE joining the contents instead of a correlated EXISTS
+                stmt = models.DataIdentifier.__table__.update().\
+                    where(and_(models.DataIdentifierAssociation.child_scope == scope,
+                               models.DataIdentifierAssociation.child_name == name,
+                               models.DataIdentifierAssociation.scope == models.DataIdentifier.scope,
+                               models.DataIdentifierAssociation.name == models.DataIdentifier.name,
+                               or_(models.DataIdentifier.is_archive.is_(None),
+                                   models.DataIdentifier.is_archive == false()))).\
+                    values(is_archive=True)
+                session.execute(stmt)
+            else:
+                session.query(models.DataIdentifier).filter(
+                    exists(select([1]).prefix_with("/*+ INDEX(CONTENTS CONTENTS_CHILD_SCOPE_NAME_IDX) */", dialect="oracle")).where(
+                        and_(models.DataIdentifierAssociation.child_scope == scope,
+                             models.DataIdentifierAssociation.child_name == name,
+                             models.DataIdentifierAssociation.scope == models.DataIdentifier.scope,
+                             models.DataIdentifierAssociation.name == models.DataIdentifier.name))
+                ).filter(
+                    or_(models.DataIdentifier.is_archive.is_(None),
+                        models.DataIdentifier.is_archive == false())
+                ).update({"is_archive": True}, synchronize_session=False)
 
 
 @transactional_session
@@ -359,54 +448,51 @@ def __add_files_to_dataset(scope, name, files, account, rse_id, ignore_duplicate
     :param ignore_duplicate: If True, ignore duplicate entries.
     :param session: The database session in use.
     """
-    # Get metadata from dataset
-    try:
-        dataset_meta = validate_name(scope=scope, name=name, did_type='D')
-    except Exception:
-        dataset_meta = None
-
     if rse_id:
+        # Get metadata from dataset, it is only used for the new replicas
+        try:
+            dataset_meta = validate_name(scope=scope, name=name, did_type='D')
+        except Exception:
+            dataset_meta = None
+
         rucio.core.replica.add_replicas(rse_id=rse_id, files=files, dataset_meta=dataset_meta,
                                         account=account, session=session)
 
     files = get_files(files=files, session=session)
 
-    existing_content = []
-    if ignore_duplicate:
-        content_query = session.query(models.DataIdentifierAssociation.scope,
-                                      models.DataIdentifierAssociation.name,
-                                      models.DataIdentifierAssociation.child_scope,
+    # PostgreSQL skips the duplicates while inserting, other databases need to look them up first
+    skip_duplicates_on_insert = ignore_duplicate and session.bind.dialect.name == 'postgresql'
+
+    existing_content = set()
+    if ignore_duplicate and not skip_duplicates_on_insert:
+        content_query = session.query(models.DataIdentifierAssociation.child_scope,
                                       models.DataIdentifierAssociation.child_name).\
-            with_hint(models.DataIdentifierAssociation, "INDEX(CONTENTS CONTENTS_PK)", 'oracle')
-        content_condition = []
-        for file in files:
-            content_condition.append(and_(models.DataIdentifierAssociation.scope == scope,
-                                          models.DataIdentifierAssociation.name == name,
-                                          models.DataIdentifierAssociation.child_scope == file['scope'],
-                                          models.DataIdentifierAssociation.child_name == file['name']))
-        for row in content_query.filter(or_(*content_condition)):
-            existing_content.append(row)
+            with_hint(models.DataIdentifierAssociation, "INDEX(CONTENTS CONTENTS_PK)", 'oracle').\
+            filter_by(scope=scope, name=name)
+        file_keys = [(file['scope'], file['name']) for file in files]
+        for clause in _composite_key_clauses((models.DataIdentifierAssociation.child_scope, models.DataIdentifierAssociation.child_name), file_keys):
+            for row in content_query.filter(clause):
+                existing_content.add((row.child_scope, row.child_name))
 
     contents = []
-    added_archives_condition = []
+    added_file_keys = []
+    content_template = {'scope': scope, 'name': name, 'did_type': DIDType.DATASET,
+                        'child_type': DIDType.FILE, 'rule_evaluation': True}
     for file in files:
-        if not existing_content or (scope, name, file['scope'], file['name']) not in existing_content:
-            contents.append({'scope': scope, 'name': name, 'child_scope': file['scope'],
+        if (file['scope'], file['name']) not in existing_content:
+            contents.append({**content_template, 'child_scope': file['scope'],
                              'child_name': file['name'], 'bytes': file['bytes'],
                              'adler32': file.get('adler32'),
                              'guid': file['guid'], 'events': file['events'],
-                             'md5': file.get('md5'), 'did_type': DIDType.DATASET,
-                             'child_type': DIDType.FILE, 'rule_evaluation': True})
-            added_archives_condition.append(
-                and_(models.DataIdentifier.scope == file['scope'],
-                     models.DataIdentifier.name == file['name'],
-                     models.DataIdentifier.is_archive == true()))
+                             'md5': file.get('md5')})
+            added_file_keys.append((file['scope'], file['name']))
 
     # if any of the attached files is an archive, set is_archive = True on the dataset
-    if session.query(models.DataIdentifier). \
-            with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle'). \
-            filter(or_(*added_archives_condition)). \
-            first() is not None:
+    archive_query = session.query(models.DataIdentifier.scope). \
+        with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle'). \
+        filter(models.DataIdentifier.is_archive == true())
+    if any(archive_query.filter(clause).first() is not None
+           for clause in _composite_key_clauses((models.DataIdentifier.scope, models.DataIdentifier.name), added_file_keys)):
         session.query(models.DataIdentifier). \
             filter(models.DataIdentifier.scope == scope). \
             filter(models.DataIdentifier.name == name). \
@@ -415,21 +501,17 @@ def __add_files_to_dataset(scope, name, files, account, rse_id, ignore_duplicate
             update({'is_archive': True})
 
     try:
-        contents and session.bulk_insert_mappings(models.DataIdentifierAssociation, contents)
+        if contents and skip_duplicates_on_insert:
+            stmt = postgresql.insert(models.DataIdentifierAssociation.__table__).\
+                on_conflict_do_nothing(index_elements=['scope', 'name', 'child_scope', 'child_name'])
+            session.execute(stmt, contents)
+        elif contents:
+            session.bulk_insert_mappings(models.DataIdentifierAssociation, contents)
         session.flush()
     except IntegrityError as error:
-        if match('.*IntegrityError.*ORA-02291: integrity constraint .*CONTENTS_CHILD_ID_FK.*violated - parent key not found.*', error.args[0]) \
-                or match('.*IntegrityError.*1452.*Cannot add or update a child row: a foreign key constraint fails.*', error.args[0]) \
-                or match('.*IntegrityError.*foreign key constraints? failed.*', error.args[0]) \
-                or match('.*IntegrityError.*insert or update on table.*violates foreign key constraint.*', error.args[0]):
+        if _matches_any(CONTENT_CHILD_NOT_FOUND_PATTERNS, error.args[0]):
             raise exception.DataIdentifierNotFound("Data identifier not found")
-        elif match('.*IntegrityError.*ORA-00001: unique constraint .*CONTENTS_PK.*violated.*', error.args[0]) \
-                or match('.*IntegrityError.*UNIQUE constraint failed: contents.scope, contents.name, contents.child_scope, contents.child_name.*', error.args[0])\
-                or match('.*IntegrityError.*duplicate key value violates unique constraint.*', error.args[0]) \
-                or match('.*UniqueViolation.*duplicate key value violates unique constraint.*', error.args[0]) \
-                or match('.*IntegrityError.*1062.*Duplicate entry .*for key.*PRIMARY.*', error.args[0]) \
-                or match('.*duplicate entry.*key.*PRIMARY.*', error.args[0]) \
-                or match('.*IntegrityError.*columns? .*not unique.*', error.args[0]):
+        elif _matches_any(FILE_CONTENT_DUPLICATE_PATTERNS, error.args[0]):
             raise exception.FileAlreadyExists(error.args)
         else:
             raise exception.RucioException(error.args)
@@ -447,71 +529,67 @@ def __add_collections_to_container(scope, name, collections, account, session):
     :param session: The database session in use.
     """
 
-    condition = or_()
+    collection_keys = []
     for cond in collections:
 
         if (scope == cond['scope']) and (name == cond['name']):
             raise exception.UnsupportedOperation('Self-append is not valid!')
 
-        condition.append(and_(models.DataIdentifier.scope == cond['scope'],
-                              models.DataIdentifier.name == cond['name']))
+        collection_keys.append((cond['scope'], cond['name']))
+
+    query = session.query(models.DataIdentifier.scope,
+                          models.DataIdentifier.name,
+                          models.DataIdentifier.did_type).with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle')
 
     available_dids = {}
     child_type = None
-    for row in session.query(models.DataIdentifier.scope,
-                             models.DataIdentifier.name,
-                             models.DataIdentifier.did_type).with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').filter(condition):
+    for clause in _composite_key_clauses((models.DataIdentifier.scope, models.DataIdentifier.name), collection_keys):
+        for row in query.filter(clause):
 
-        if row.did_type == DIDType.FILE:
-            raise exception.UnsupportedOperation("Adding a file (%s:%s) to a container (%s:%s) is forbidden" % (row.scope, row.name, scope, name))
+            if row.did_type == DIDType.FILE:
+                raise exception.UnsupportedOperation("Adding a file (%s:%s) to a container (%s:%s) is forbidden" % (row.scope, row.name, scope, name))
 
-        if not child_type:
-            child_type = row.did_type
+            if not child_type:
+                child_type = row.did_type
 
-        available_dids['%s:%s' % (row.scope.internal, row.name)] = row.did_type
+            available_dids['%s:%s' % (row.scope.internal, row.name)] = row.did_type
 
-        if child_type != row.did_type:
-            raise exception.UnsupportedOperation("Mixed collection is not allowed: '%s:%s' is a %s(expected type: %s)" % (row.scope, row.name, row.did_type, child_type))
+            if child_type != row.did_type:
+                raise exception.UnsupportedOperation("Mixed collection is not allowed: '%s:%s' is a %s(expected type: %s)" % (row.scope, row.name, row.did_type, child_type))
 
-    for c in collections:
-        did_asso = models.DataIdentifierAssociation(scope=scope, name=name, child_scope=c['scope'], child_name=c['name'],
-                                                    did_type=DIDType.CONTAINER, child_type=available_dids.get('%s:%s' % (c['scope'].internal, c['name'])), rule_evaluation=True)
-        did_asso.save(session=session, flush=False)
-        # Send AMI messages
-        if child_type == DIDType.CONTAINER:
-            chld_type = 'CONTAINER'
-        elif child_type == DIDType.DATASET:
-            chld_type = 'DATASET'
-        else:
-            chld_type = 'UNKNOWN'
+    # Send AMI messages
+    if child_type == DIDType.CONTAINER:
+        chld_type = 'CONTAINER'
+    elif child_type == DIDType.DATASET:
+        chld_type = 'DATASET'
+    else:
+        chld_type = 'UNKNOWN'
 
-        message = {'account': account.external,
-                   'scope': scope.external,
-                   'name': name,
-                   'childscope': c['scope'].external,
-                   'childname': c['name'],
-                   'childtype': chld_type}
-        if account.vo != 'def':
-            message['vo'] = account.vo
+    message_template = {'account': account.external,
+                        'scope': scope.external,
+                        'name': name,
+                        'childtype': chld_type}
+    if account.vo != 'def':
+        message_template['vo'] = account.vo
 
-        add_message('REGISTER_CNT', message, session=session)
+    contents, messages = [], []
+    for c in collections:
+        contents.append({'scope': scope, 'name': name, 'child_scope': c['scope'], 'child_name': c['name'],
+                         'did_type': DIDType.CONTAINER, 'child_type': available_dids.get('%s:%s' % (c['scope'].internal, c['name'])),
+                         'rule_evaluation': True})
+        messages.append(('REGISTER_CNT', {**message_template, 'childscope': c['scope'].external, 'childname': c['name']}))
     try:
+        contents and session.bulk_insert_mappings(models.DataIdentifierAssociation, contents)
         session.flush()
     except IntegrityError as error:
-        if match('.*IntegrityError.*ORA-02291: integrity constraint .*CONTENTS_CHILD_ID_FK.*violated - parent key not found.*', error.args[0]) \
-                or match('.*IntegrityError.*1452.*Cannot add or update a child row: a foreign key constraint fails.*', error.args[0]) \
-                or match('.*IntegrityError.*foreign key constraints? failed.*', error.args[0]) \
-                or match('.*IntegrityError.*insert or update on table.*violates foreign key constraint.*', error.args[0]):
+        if _matches_any(CONTENT_CHILD_NOT_FOUND_PATTERNS, error.args[0]):
             raise exception.DataIdentifierNotFound("Data identifier not found")
-        elif match('.*IntegrityError.*ORA-00001: unique constraint .*CONTENTS_PK.*violated.*', error.args[0]) \
-                or match('.*IntegrityError.*1062.*Duplicate entry .*for key.*PRIMARY.*', error.args[0]) \
-                or match('.*IntegrityError.*columns? scope.*name.*child_scope.*child_name.*not unique.*', error.args[0]) \
-                or match('.*IntegrityError.*duplicate key value violates unique constraint.*', error.args[0]) \
-                or match('.*UniqueViolation.*duplicate key value violates unique constraint.*', error.args[0]) \
-                or match('.*IntegrityError.* UNIQUE constraint failed: contents.scope, contents.name, contents.child_scope, contents.child_name.*', error.args[0]):
+        elif _matches_any(COLLECTION_CONTENT_DUPLICATE_PATTERNS, error.args[0]):
             raise exception.DuplicateContent(error.args)
         raise exception.RucioException(error.args)
 
+    add_messages(messages, session=session)
+
 
 @transactional_session
 def attach_dids(scope, name, dids, account, rse_id=None, session=None):
@@ -538,52 +616,68 @@ def attach_dids_to_dids(attachments, account, ignore_duplicate=False, session=No
     :param ignore_duplicate: If True, ignore duplicate entries.
     :param session: The database session in use.
     """
-    parent_did_condition = list()
-    parent_dids = list()
-    for attachment in attachments:
-        try:
-            parent_did = session.query(models.DataIdentifier).filter_by(scope=attachment['scope'], name=attachment['name']).\
+    parent_dids, seen_parent_dids = list(), set()
+
+    # Fetch all parent dids at once instead of one query per attachment
+    existing_parent_dids = {}
+    parent_keys = [(attachment['scope'], attachment['name']) for attachment in attachments]
+    for clause in _composite_key_clauses((models.DataIdentifier.scope, models.DataIdentifier.name), parent_keys):
+        for row in session.query(models.DataIdentifier.scope,
+                                 models.DataIdentifier.name,
+                                 models.DataIdentifier.did_type,
+                                 models.DataIdentifier.is_open).\
                 with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').\
-                one()
+                filter(clause):
+            existing_parent_dids[row.scope, row.name] = row
 
-            if parent_did.did_type == DIDType.FILE:
-                # check if parent file has the archive extension
-                if is_archive(attachment['name']):
-                    __add_files_to_archive(scope=attachment['scope'],
-                                           name=attachment['name'],
-                                           files=attachment['dids'],
-                                           account=account,
-                                           ignore_duplicate=ignore_duplicate,
-                                           session=session)
-                    return
-                raise exception.UnsupportedOperation("Data identifier '%(scope)s:%(name)s' is a file" % attachment)
+    def __attach_to_dataset(attachment):
+        __add_files_to_dataset(scope=attachment['scope'], name=attachment['name'],
+                               files=attachment['dids'], account=account,
+                               ignore_duplicate=ignore_duplicate,
+                               rse_id=attachment.get('rse_id'),
+                               session=session)
+
+    def __attach_to_container(attachment):
+        __add_collections_to_container(scope=attachment['scope'],
+                                       name=attachment['name'],
+                                       collections=attachment['dids'],
+                                       account=account, session=session)
 
-            elif not parent_did.is_open:
-                raise exception.UnsupportedOperation("Data identifier '%(scope)s:%(name)s' is closed" % attachment)
+    attach_handlers = {DIDType.DATASET: __attach_to_dataset,
+                       DIDType.CONTAINER: __attach_to_container}
 
-            elif parent_did.did_type == DIDType.DATASET:
-                __add_files_to_dataset(scope=attachment['scope'], name=attachment['name'],
-                                       files=attachment['dids'], account=account,
-                                       ignore_duplicate=ignore_duplicate,
-                                       rse_id=attachment.get('rse_id'),
-                                       session=session)
+    for attachment in attachments:
+        parent_did = existing_parent_dids.get((attachment['scope'], attachment['name']))
+        if parent_did is None:
+            raise exception.DataIdentifierNotFound("Data identifier '%s:%s' not found" % (attachment['scope'], attachment['name']))
+
+        if parent_did.did_type == DIDType.FILE:
+            # check if parent file has the archive extension
+            if not is_archive(attachment['name']):
+                raise exception.UnsupportedOperation("Data identifier '%(scope)s:%(name)s' is a file" % attachment)
+            __add_files_to_archive(scope=attachment['scope'],
+                                   name=attachment['name'],
+                                   files=attachment['dids'],
+                                   account=account,
+                                   ignore_duplicate=ignore_duplicate,
+                                   session=session)
+            # Attaching to an archive needs no rule re-evaluation
+            continue
 
-            elif parent_did.did_type == DIDType.CONTAINER:
-                __add_collections_to_container(scope=attachment['scope'],
-                                               name=attachment['name'],
-                                               collections=attachment['dids'],
-                                               account=account, session=session)
+        if not parent_did.is_open:
+            raise exception.UnsupportedOperation("Data identifier '%(scope)s:%(name)s' is closed" % attachment)
 
-            parent_did_condition.append(and_(models.DataIdentifier.scope == parent_did.scope,
-                                             models.DataIdentifier.name == parent_did.name))
+        attach_handlers[parent_did.did_type](attachment)
 
+        # Attaching several times to the same parent needs a single re-evaluation
+        if (parent_did.scope, parent_did.name) not in seen_parent_dids:
+            seen_parent_dids.add((parent_did.scope, parent_did.name))
             parent_dids.append({'scope': parent_did.scope,
                                 'name': parent_did.name,
                                 'rule_evaluation_action': DIDReEvaluation.ATTACH})
-        except NoResultFound:
-            raise exception.DataIdentifierNotFound("Data identifier '%s:%s' not found" % (attachment['scope'], attachment['name']))
 
-        session.bulk_insert_mappings(models.UpdatedDID, parent_dids)
+    # Mark all parents for rule re-evaluation with a single executemany insertion
+    parent_dids and session.bulk_insert_mappings(models.UpdatedDID, parent_dids)
 
 
 @transactional_session
@@ -602,9 +696,16 @@ def delete_dids(dids, account, expire_rules=False, session=None, logger=logging.
     rule_id_clause, content_clause = [], []
     parent_content_clause, did_clause = [], []
     collection_replica_clause, file_clause = [], []
-    not_purge_replicas = []
+    not_purge_replicas = set()
     did_followed_clause = []
     metadata_to_delete = []
+    archive_datasets = []
+    messages = []
+
+    # The generic did metadata table is not available before Oracle 12
+    delete_generic_metadata = True
+    if session.bind.dialect.name == 'oracle':
+        delete_generic_metadata = int(session.connection().connection.version.split('.')[0]) >= 12
 
     for did in dids:
         logger(logging.INFO, 'Removing did %(scope)s:%(name)s (%(did_type)s)' % did)
@@ -617,15 +718,11 @@ def delete_dids(dids, account, expire_rules=False, session=None, logger=logging.
                                                   models.CollectionReplica.name == did['name']))
             did_followed_clause.append(and_(models.DidsFollowed.scope == did['scope'], models.DidsFollowed.name == did['name']))
 
-        # ATLAS LOCALGROUPDISK Archive policy
         if did['did_type'] == DIDType.DATASET and did['scope'].external != 'archive':
-            try:
-                rucio.core.rule.archive_localgroupdisk_datasets(scope=did['scope'], name=did['name'], session=session)
-            except exception.UndefinedPolicy:
-                pass
+            archive_datasets.append({'scope': did['scope'], 'name': did['name']})
 
         if did['purge_replicas'] is False:
-            not_purge_replicas.append((did['scope'], did['name']))
+            not_purge_replicas.add((did['scope'], did['name']))
 
             # Archive content
             # Disable for postgres
@@ -637,11 +734,7 @@ def delete_dids(dids, account, expire_rules=False, session=None, logger=logging.
         parent_content_clause.append(and_(models.DataIdentifierAssociation.child_scope == did['scope'], models.DataIdentifierAssociation.child_name == did['name']))
         rule_id_clause.append(and_(models.ReplicationRule.scope == did['scope'], models.ReplicationRule.name == did['name']))
 
-        if session.bind.dialect.name == 'oracle':
-            oracle_version = int(session.connection().connection.version.split('.')[0])
-            if oracle_version >= 12:
-                metadata_to_delete.append(and_(models.DidMeta.scope == did['scope'], models.DidMeta.name == did['name']))
-        else:
+        if delete_generic_metadata:
             metadata_to_delete.append(and_(models.DidMeta.scope == did['scope'], models.DidMeta.name == did['name']))
 
         # Send message
@@ -651,10 +744,21 @@ def delete_dids(dids, account, expire_rules=False, session=None, logger=logging.
         if did['scope'].vo != 'def':
             message['vo'] = did['scope'].vo
 
-        add_message('ERASE', message, session=session)
+        messages.append(('ERASE', message))
+    add_messages(messages, session=session)
+
+    # ATLAS LOCALGROUPDISK Archive policy
+    if archive_datasets:
+        try:
+            rucio.core.rule.archive_localgroupdisk_datasets_bulk(dids=archive_datasets, session=session, logger=logger)
+        except exception.UndefinedPolicy:
+            pass
+
     # Delete rules on did
     skip_deletion = False  # Skip deletion in case of expiration of a rule
     if rule_id_clause:
+        if expire_rules:
+            expire_rules_locks_size = int(config_core.get('undertaker', 'expire_rules_locks_size', default=10000, session=session))
         with record_timer_block('undertaker.rules'):
             for (rule_id, scope, name, rse_expression, locks_ok_cnt, locks_replicating_cnt, locks_stuck_cnt) in session.query(models.ReplicationRule.id,
                                                                                                                               models.ReplicationRule.scope,
@@ -670,7 +774,7 @@ def delete_dids(dids, account, expire_rules=False, session=None, logger=logging.
                     purge_replicas = False
                 else:
                     purge_replicas = True
-                if expire_rules and locks_ok_cnt + locks_replicating_cnt + locks_stuck_cnt > int(config_core.get('undertaker', 'expire_rules_locks_size', default=10000, session=session)):
+                if expire_rules and locks_ok_cnt + locks_replicating_cnt + locks_stuck_cnt > expire_rules_locks_size:
                     # Expire the rule (soft=True)
                     rucio.core.rule.delete_rule(rule_id=rule_id, purge_replicas=purge_replicas, soft=True, delete_parent=True, nowait=True, session=session)
                     # Update expiration of did
@@ -686,9 +790,18 @@ def delete_dids(dids, account, expire_rules=False, session=None, logger=logging.
     existing_parent_dids = False
     if parent_content_clause:
         with record_timer_block('undertaker.parent_content'):
-            for parent_did in session.query(models.DataIdentifierAssociation).filter(or_(*parent_content_clause)):
-                existing_parent_dids = True
-                detach_dids(scope=parent_did.scope, name=parent_did.name, dids=[{'scope': parent_did.child_scope, 'name': parent_did.child_name}], session=session)
+            # Group the children by parent, to detach them with one call per parent
+            children_by_parent = {}
+            query = session.query(models.DataIdentifierAssociation.scope,
+                                  models.DataIdentifierAssociation.name,
+                                  models.DataIdentifierAssociation.child_scope,
+                                  models.DataIdentifierAssociation.child_name).\
+                filter(or_(*parent_content_clause))
+            for parent_scope, parent_name, child_scope, child_name in query:
+                children_by_parent.setdefault((parent_scope, parent_name), []).append({'scope': child_scope, 'name': child_name})
+            existing_parent_dids = bool(children_by_parent)
+            for (parent_scope, parent_name), children in children_by_parent.items():
+                detach_dids(scope=parent_scope, name=parent_name, dids=children, session=session)
 
     # Remove content
     if content_clause:
@@ -705,16 +818,9 @@ def delete_dids(dids, account, expire_rules=False, session=None, logger=logging.
 
     # Remove generic did metadata
     if metadata_to_delete:
-        if session.bind.dialect.name == 'oracle':
-            oracle_version = int(session.connection().connection.version.split('.')[0])
-            if oracle_version >= 12:
-                with record_timer_block('undertaker.did_meta'):
-                    rowcount = session.query(models.DidMeta).filter(or_(*metadata_to_delete)).\
-                        delete(synchronize_session=False)
-        else:
-            with record_timer_block('undertaker.did_meta'):
-                rowcount = session.query(models.DidMeta).filter(or_(*metadata_to_delete)).\
-                    delete(synchronize_session=False)
+        with record_timer_block('undertaker.did_meta'):
+            rowcount = session.query(models.DidMeta).filter(or_(*metadata_to_delete)).\
+                delete(synchronize_session=False)
 
     # remove data identifier
     if existing_parent_dids:
@@ -750,12 +856,12 @@ def detach_dids(scope, name, dids, session=None):
     :param session: The database session in use.
     """
     # Row Lock the parent did
-    query = session.query(models.DataIdentifier).filter_by(scope=scope, name=name).\
+    query = session.query(models.DataIdentifier.did_type, models.DataIdentifier.created_at).filter_by(scope=scope, name=name).\
         filter(or_(models.DataIdentifier.did_type == DIDType.CONTAINER, models.DataIdentifier.did_type == DIDType.DATASET))
     try:
         did = query.one()
         # Mark for rule re-evaluation
-        models.UpdatedDID(scope=scope, name=name, rule_evaluation_action=DIDReEvaluation.DETACH).save(session=session, flush=False)
+        session.bulk_insert_mappings(models.UpdatedDID, [{'scope': scope, 'name': name, 'rule_evaluation_action': DIDReEvaluation.DETACH}])
     except NoResultFound:
         raise exception.DataIdentifierNotFound("Data identifier '%(scope)s:%(name)s' not found" % locals())
 
@@ -763,45 +869,73 @@ def detach_dids(scope, name, dids, session=None):
     query_all = session.query(models.DataIdentifierAssociation).filter_by(scope=scope, name=name)
     if query_all.first() is None:
         raise exception.DataIdentifierNotFound("Data identifier '%(scope)s:%(name)s' has no child data identifiers." % locals())
-    for source in dids:
-        if (scope == source['scope']) and (name == source['name']):
-            raise exception.UnsupportedOperation('Self-detach is not valid.')
-        child_scope = source['scope']
-        child_name = source['name']
-        associ_did = query_all.filter_by(child_scope=child_scope, child_name=child_name).first()
-        if associ_did is None:
+
+    child_keys = list(dict.fromkeys((source['scope'], source['name']) for source in dids))
+    if (scope, name) in child_keys:
+        raise exception.UnsupportedOperation('Self-detach is not valid.')
+
+    associations = {}
+    child_clauses = list(_composite_key_clauses((models.DataIdentifierAssociation.child_scope, models.DataIdentifierAssociation.child_name), child_keys))
+    for child_clause in child_clauses:
+        for associ_did in session.query(models.DataIdentifierAssociation.child_scope,
+                                        models.DataIdentifierAssociation.child_name,
+                                        models.DataIdentifierAssociation.did_type,
+                                        models.DataIdentifierAssociation.child_type,
+                                        models.DataIdentifierAssociation.bytes,
+                                        models.DataIdentifierAssociation.adler32,
+                                        models.DataIdentifierAssociation.md5,
+                                        models.DataIdentifierAssociation.guid,
+                                        models.DataIdentifierAssociation.events,
+                                        models.DataIdentifierAssociation.rule_evaluation,
+                                        models.DataIdentifierAssociation.created_at,
+                                        models.DataIdentifierAssociation.updated_at).\
+                filter_by(scope=scope, name=name).\
+                filter(child_clause):
+            associations[(associ_did.child_scope, associ_did.child_name)] = associ_did
+
+    for child_scope, child_name in child_keys:
+        if (child_scope, child_name) not in associations:
             raise exception.DataIdentifierNotFound("Data identifier '%(child_scope)s:%(child_name)s' not found under '%(scope)s:%(name)s'" % locals())
 
+    for child_clause in child_clauses:
+        session.query(models.DataIdentifierAssociation).\
+            filter_by(scope=scope, name=name).\
+            filter(child_clause).\
+            delete(synchronize_session=False)
+
+    # Archive contents
+    deleted_at = datetime.utcnow()
+    detached_bytes, detached_events = 0, 0
+    parent_type = str(did.did_type)
+    message_template = {'scope': scope.external, 'name': name}
+    if scope.vo != 'def':
+        message_template['vo'] = scope.vo
+
+    history, messages = [], []
+    for child_scope, child_name in child_keys:
+        associ_did = associations[(child_scope, child_name)]
         child_type = associ_did.child_type
         child_size = associ_did.bytes
         child_events = associ_did.events
-        if did.length:
-            did.length -= 1
-        if did.bytes and child_size:
-            did.bytes -= child_size
-        if did.events and child_events:
-            did.events -= child_events
-        associ_did.delete(session=session)
-
-        # Archive contents
-        # If reattach happens, merge the latest due to primary key constraint
-        new_detach = models.DataIdentifierAssociationHistory(scope=associ_did.scope,
-                                                             name=associ_did.name,
-                                                             child_scope=associ_did.child_scope,
-                                                             child_name=associ_did.child_name,
-                                                             did_type=associ_did.did_type,
-                                                             child_type=associ_did.child_type,
-                                                             bytes=associ_did.bytes,
-                                                             adler32=associ_did.adler32,
-                                                             md5=associ_did.md5,
-                                                             guid=associ_did.guid,
-                                                             events=associ_did.events,
-                                                             rule_evaluation=associ_did.rule_evaluation,
-                                                             did_created_at=did.created_at,
-                                                             created_at=associ_did.created_at,
-                                                             updated_at=associ_did.updated_at,
-                                                             deleted_at=datetime.utcnow())
-        new_detach.save(session=session, flush=False)
+        detached_bytes += child_size or 0
+        detached_events += child_events or 0
+
+        history.append({'scope': scope,
+                        'name': name,
+                        'child_scope': child_scope,
+                        'child_name': child_name,
+                        'did_type': associ_did.did_type,
+                        'child_type': child_type,
+                        'bytes': child_size,
+                        'adler32': associ_did.adler32,
+                        'md5': associ_did.md5,
+                        'guid': associ_did.guid,
+                        'events': child_events,
+                        'rule_evaluation': associ_did.rule_evaluation,
+                        'did_created_at': did.created_at,
+                        'created_at': associ_did.created_at,
+                        'updated_at': associ_did.updated_at,
+                        'deleted_at': deleted_at})
 
         # Send message for AMI. To be removed in the future when they use the DETACH messages
         if did.did_type == DIDType.CONTAINER:
@@ -812,26 +946,24 @@ def detach_dids(scope, name, dids, session=None):
             else:
                 chld_type = 'UNKNOWN'
 
-            message = {'scope': scope.external,
-                       'name': name,
-                       'childscope': source['scope'].external,
-                       'childname': source['name'],
-                       'childtype': chld_type}
-            if scope.vo != 'def':
-                message['vo'] = scope.vo
+            messages.append(('ERASE_CNT', {**message_template, 'childscope': child_scope.external,
+                                           'childname': child_name, 'childtype': chld_type}))
 
-            add_message('ERASE_CNT', message, session=session)
+        messages.append(('DETACH', {**message_template, 'did_type': parent_type, 'child_scope': child_scope.external,
+                                    'child_name': str(child_name), 'child_type': str(child_type)}))
 
-        message = {'scope': scope.external,
-                   'name': name,
-                   'did_type': str(did.did_type),
-                   'child_scope': source['scope'].external,
-                   'child_name': str(source['name']),
-                   'child_type': str(child_type)}
-        if scope.vo != 'def':
-            message['vo'] = scope.vo
+    def __decrement(column, value):
+        # Counters which are unset or already zero are left as they are and never drop below zero
+        return case([(column > value, column - value), (column > 0, 0)], else_=column)
 
-        add_message('DETACH', message, session=session)
+    if child_keys:
+        session.query(models.DataIdentifier).filter_by(scope=scope, name=name).\
+            update({'length': __decrement(models.DataIdentifier.length, len(child_keys)),
+                    'bytes': __decrement(models.DataIdentifier.bytes, detached_bytes),
+                    'events': __decrement(models.DataIdentifier.events, detached_events)}, synchronize_session=False)
+
+    history and session.bulk_insert_mappings(models.DataIdentifierAssociationHistory, history)
+    add_messages(messages, session=session)
 
 
 @stream_session
@@ -853,7 +985,9 @@ def list_new_dids(did_type, thread=None, total_threads=None, chunk_size=1000, se
                    models.DataIdentifier.name == models.ReplicationRule.name,
                    models.ReplicationRule.state == RuleState.INJECT))
 
-    query = session.query(models.DataIdentifier).\
+    query = session.query(models.DataIdentifier.scope,
+                          models.DataIdentifier.name,
+                          models.DataIdentifier.did_type).\
         with_hint(models.DataIdentifier, "index(dids DIDS_IS_NEW_IDX)", 'oracle').\
         filter_by(is_new=True).\
         filter(~exists(stmt))
@@ -866,13 +1000,8 @@ def list_new_dids(did_type, thread=None, total_threads=None, chunk_size=1000, se
 
     query = filter_thread_work(session=session, query=query, total_threads=total_threads, thread_id=thread, hash_variable='name')
 
-    row_count = 0
-    for chunk in query.yield_per(10):
-        row_count += 1
-        if row_count <= chunk_size:
-            yield {'scope': chunk.scope, 'name': chunk.name, 'did_type': chunk.did_type}  # TODO Change this to the proper filebytes [RUCIO-199]
-        else:
-            break
+    for chunk in query.limit(chunk_size).yield_per(10):
+        yield {'scope': chunk.scope, 'name': chunk.name, 'did_type': chunk.did_type}  # TODO Change this to the proper filebytes [RUCIO-199]
 
 
 @transactional_session
@@ -886,16 +1015,22 @@ def set_new_dids(dids, new_flag, session=None):
     """
     if session.bind.dialect.name == 'postgresql':
         new_flag = bool(new_flag)
-    for did in dids:
+    did_keys = list(dict.fromkeys((did['scope'], did['name']) for did in dids))
+    did_clauses = list(_composite_key_clauses((models.DataIdentifier.scope, models.DataIdentifier.name), did_keys))
+    rowcount = 0
+    for clause in did_clauses:
         try:
-
-            rowcount = session.query(models.DataIdentifier).\
-                filter_by(scope=did['scope'], name=did['name']).\
+            rowcount += session.query(models.DataIdentifier).\
+                filter(clause).\
                 update({'is_new': new_flag}, synchronize_session=False)
-            if not rowcount:
-                raise exception.DataIdentifierNotFound("Data identifier '%s:%s' not found" % (did['scope'], did['name']))
         except DatabaseError as error:
-            raise exception.DatabaseException('%s : Cannot update %s:%s' % (error.args[0], did['scope'], did['name']))
+            raise exception.DatabaseException('%s : Cannot update %s' % (error.args[0], ', '.join('%s:%s' % key for key in did_keys)))
+    if rowcount != len(did_keys):
+        existing_dids = set()
+        for clause in did_clauses:
+            existing_dids.update(session.query(models.DataIdentifier.scope, models.DataIdentifier.name).filter(clause))
+        scope, name = next(key for key in did_keys if key not in existing_dids)
+        raise exception.DataIdentifierNotFound("Data identifier '%s:%s' not found" % (scope, name))
     try:
         session.flush()
     except IntegrityError as error:
@@ -915,7 +1050,12 @@ def list_content(scope, name, session=None):
     :param session: The database session in use.
     """
     try:
-        query = session.query(models.DataIdentifierAssociation).\
+        query = session.query(models.DataIdentifierAssociation.child_scope,
+                              models.DataIdentifierAssociation.child_name,
+                              models.DataIdentifierAssociation.child_type,
+                              models.DataIdentifierAssociation.bytes,
+                              models.DataIdentifierAssociation.adler32,
+                              models.DataIdentifierAssociation.md5).\
             with_hint(models.DataIdentifierAssociation, "INDEX(CONTENTS CONTENTS_PK)", 'oracle').\
             filter_by(scope=scope, name=name)
         for tmp_did in query.yield_per(5):
@@ -966,7 +1106,7 @@ def list_parent_dids(scope, name, session=None):
     query = session.query(models.DataIdentifierAssociation.scope,
                           models.DataIdentifierAssociation.name,
                           models.DataIdentifierAssociation.did_type).filter_by(child_scope=scope, child_name=name)
-    for did in query.yield_per(5):
+    for did in query.yield_per(500):
         yield {'scope': did.scope, 'name': did.name, 'type': did.did_type}
 
 
@@ -982,14 +1122,37 @@ def list_all_parent_dids(scope, name, session=None):
     :rtype:           Generator.
     """
 
-    query = session.query(models.DataIdentifierAssociation.scope,
-                          models.DataIdentifierAssociation.name,
-                          models.DataIdentifierAssociation.did_type).filter_by(child_scope=scope, child_name=name)
-    for did in query.yield_per(5):
+    if not _supports_recursive_cte(session):
+        # Walk up the hierarchy with one query per parent, listing each parent once
+        parents, children = set(), [(scope, name)]
+        while children:
+            child_scope, child_name = children.pop()
+            query = session.query(models.DataIdentifierAssociation.scope,
+                                  models.DataIdentifierAssociation.name,
+                                  models.DataIdentifierAssociation.did_type).filter_by(child_scope=child_scope, child_name=child_name)
+            for did in query.yield_per(5):
+                if (did.scope, did.name) not in parents:
+                    parents.add((did.scope, did.name))
+                    children.append((did.scope, did.name))
+                    yield {'scope': did.scope, 'name': did.name, 'type': did.did_type}
+        return
+
+    # Walk up the hierarchy with a recursive common table expression instead of one query per parent
+    parent_dids = session.query(models.DataIdentifierAssociation.scope,
+                                models.DataIdentifierAssociation.name,
+                                models.DataIdentifierAssociation.did_type).\
+        filter_by(child_scope=scope, child_name=name).\
+        cte(name='parent_dids', recursive=True)
+    parent_dids = parent_dids.union_all(
+        session.query(models.DataIdentifierAssociation.scope,
+                      models.DataIdentifierAssociation.name,
+                      models.DataIdentifierAssociation.did_type).
+        join(parent_dids, and_(models.DataIdentifierAssociation.child_scope == parent_dids.c.scope,
+                               models.DataIdentifierAssociation.child_name == parent_dids.c.name)))
+
+    query = session.query(parent_dids.c.scope, parent_dids.c.name, parent_dids.c.did_type).distinct()
+    for did in query.yield_per(500):
         yield {'scope': did.scope, 'name': did.name, 'type': did.did_type}
-        # Note that only Python3 supports recursive yield, that's the reason to do the nested for.
-        for pdid in list_all_parent_dids(scope=did.scope, name=did.name, session=session):
-            yield {'scope': pdid['scope'], 'name': pdid['name'], 'type': pdid['type']}
 
 
 @transactional_session
@@ -1004,23 +1167,97 @@ def list_child_datasets(scope, name, session=None):
     :rtype:           Generator
     """
 
-    result = []
-    query = session.query(models.DataIdentifierAssociation.child_scope,
-                          models.DataIdentifierAssociation.child_name,
-                          models.DataIdentifierAssociation.child_type).filter(models.DataIdentifierAssociation.scope == scope,
-                                                                              models.DataIdentifierAssociation.name == name,
-                                                                              models.DataIdentifierAssociation.child_type != DIDType.FILE)
-    query = query.with_hint(models.DataIdentifierAssociation, "INDEX(CONTENTS CONTENTS_PK)", 'oracle')
-    for child_scope, child_name, child_type in query.yield_per(5):
-        if child_type == DIDType.CONTAINER:
-            result.extend(list_child_datasets(scope=child_scope, name=child_name, session=session))
-        else:
-            result.append({'scope': child_scope, 'name': child_name, 'type': child_type})
+    # Deduplicate while descending: every dataset is kept once and shared containers are only listed once
+    result, visited_containers = {}, {(scope, name)}
+
+    def __list_child_datasets(scope, name):
+        query = session.query(models.DataIdentifierAssociation.child_scope,
+                              models.DataIdentifierAssociation.child_name,
+                              models.DataIdentifierAssociation.child_type).filter(models.DataIdentifierAssociation.scope == scope,
+                                                                                  models.DataIdentifierAssociation.name == name,
+                                                                                  models.DataIdentifierAssociation.child_type != DIDType.FILE)
+        query = query.with_hint(models.DataIdentifierAssociation, "INDEX(CONTENTS CONTENTS_PK)", 'oracle')
+        for child_scope, child_name, child_type in query.yield_per(500):
+            if child_type == DIDType.CONTAINER:
+                if (child_scope, child_name) not in visited_containers:
+                    visited_containers.add((child_scope, child_name))
+                    __list_child_datasets(scope=child_scope, name=child_name)
+            elif (child_scope, child_name) not in result:
+                result[(child_scope, child_name)] = {'scope': child_scope, 'name': child_name, 'type': child_type}
+
+    __list_child_datasets(scope=scope, name=name)
+    return result.values()
+
 
-    # remove duplicate entries
-    result = {(elem['scope'], elem['name']): elem for elem in result}.values()
+def __list_files_iteratively(scope, name, did_type, long, session):
+    """
+    List the file contents of a collection with one query per collection,
+    for database backends without recursive common table expressions.
+
+    :param scope:      The scope name.
+    :param name:       The collection name.
+    :param did_type:   The type of the collection.
+    :param long:       A boolean to choose if more metadata are returned or not.
+    :param session:    The database session in use.
+    """
+    cnt_query = session.\
+        query(models.DataIdentifierAssociation.child_scope,
+              models.DataIdentifierAssociation.child_name,
+              models.DataIdentifierAssociation.child_type).\
+        with_hint(models.DataIdentifierAssociation,
+                  "INDEX(CONTENTS CONTENTS_PK)", 'oracle')
 
-    return result
+    if long:
+        dst_cnt_query = session.\
+            query(models.DataIdentifierAssociation.child_scope,
+                  models.DataIdentifierAssociation.child_name,
+                  models.DataIdentifierAssociation.child_type,
+                  models.DataIdentifierAssociation.bytes,
+                  models.DataIdentifierAssociation.adler32,
+                  models.DataIdentifierAssociation.guid,
+                  models.DataIdentifierAssociation.events,
+                  models.DataIdentifier.lumiblocknr).\
+            with_hint(models.DataIdentifierAssociation,
+                      "INDEX_RS_ASC(DIDS DIDS_PK) INDEX_RS_ASC(CONTENTS CONTENTS_PK) NO_INDEX_FFS(CONTENTS CONTENTS_PK)",
+                      "oracle").\
+            filter(and_(models.DataIdentifier.scope == models.DataIdentifierAssociation.child_scope,
+                        models.DataIdentifier.name == models.DataIdentifierAssociation.child_name))
+    else:
+        dst_cnt_query = session.\
+            query(models.DataIdentifierAssociation.child_scope,
+                  models.DataIdentifierAssociation.child_name,
+                  models.DataIdentifierAssociation.child_type,
+                  models.DataIdentifierAssociation.bytes,
+                  models.DataIdentifierAssociation.adler32,
+                  models.DataIdentifierAssociation.guid,
+                  models.DataIdentifierAssociation.events,
+                  bindparam("lumiblocknr", None)).\
+            with_hint(models.DataIdentifierAssociation,
+                      "INDEX(CONTENTS CONTENTS_PK)", 'oracle')
+
+    dids = [(scope, name, did_type), ]
+    while dids:
+        s, n, t = dids.pop()
+        if t == DIDType.DATASET:
+            query = dst_cnt_query.\
+                filter(and_(models.DataIdentifierAssociation.scope == s,
+                            models.DataIdentifierAssociation.name == n))
+
+            for child_scope, child_name, child_type, bytes, adler32, guid, events, lumiblocknr in query.yield_per(500):
+                if long:
+                    yield {'scope': child_scope, 'name': child_name,
+                           'bytes': bytes, 'adler32': adler32,
+                           'guid': guid and guid.upper(),
+                           'events': events,
+                           'lumiblocknr': lumiblocknr}
+                else:
+                    yield {'scope': child_scope, 'name': child_name,
+                           'bytes': bytes, 'adler32': adler32,
+                           'guid': guid and guid.upper(),
+                           'events': events}
+        else:
+            for child_scope, child_name, child_type in cnt_query.filter_by(scope=s, name=n).yield_per(500):
+                dids.append((child_scope, child_name, child_type))
 
 
 @stream_session
@@ -1052,65 +1289,72 @@ def list_files(scope, name, long=False, session=None):
                 yield {'scope': did[0], 'name': did[1], 'bytes': did[2],
                        'adler32': did[3], 'guid': did[4] and did[4].upper(),
                        'events': did[5]}
+        elif not _supports_recursive_cte(session):
+            for file in __list_files_iteratively(scope=scope, name=name, did_type=did[7], long=long, session=session):
+                yield file
         else:
-            cnt_query = session.\
+            # Walk down the collections with a recursive common table expression instead of one query per collection
+            contents = session.\
+                query(models.DataIdentifierAssociation.child_scope,
+                      models.DataIdentifierAssociation.child_name,
+                      models.DataIdentifierAssociation.child_type,
+                      models.DataIdentifierAssociation.bytes,
+                      models.DataIdentifierAssociation.adler32,
+                      models.DataIdentifierAssociation.guid,
+                      models.DataIdentifierAssociation.events).\
+                with_hint(models.DataIdentifierAssociation,
+                          "INDEX(CONTENTS CONTENTS_PK)", 'oracle').\
+                filter_by(scope=scope, name=name).\
+                cte(name='child_contents', recursive=True)
+            contents = contents.union_all(
+                session.
                 query(models.DataIdentifierAssociation.child_scope,
                       models.DataIdentifierAssociation.child_name,
-                      models.DataIdentifierAssociation.child_type).\
+                      models.DataIdentifierAssociation.child_type,
+                      models.DataIdentifierAssociation.bytes,
+                      models.DataIdentifierAssociation.adler32,
+                      models.DataIdentifierAssociation.guid,
+                      models.DataIdentifierAssociation.events).
                 with_hint(models.DataIdentifierAssociation,
-                          "INDEX(CONTENTS CONTENTS_PK)", 'oracle')
+                          "INDEX(CONTENTS CONTENTS_PK)", 'oracle').
+                join(contents, and_(models.DataIdentifierAssociation.scope == contents.c.child_scope,
+                                    models.DataIdentifierAssociation.name == contents.c.child_name,
+                                    contents.c.child_type != DIDType.FILE)))
 
             if long:
-                dst_cnt_query = session.\
-                    query(models.DataIdentifierAssociation.child_scope,
-                          models.DataIdentifierAssociation.child_name,
-                          models.DataIdentifierAssociation.child_type,
-                          models.DataIdentifierAssociation.bytes,
-                          models.DataIdentifierAssociation.adler32,
-                          models.DataIdentifierAssociation.guid,
-                          models.DataIdentifierAssociation.events,
+                query = session.\
+                    query(contents.c.child_scope,
+                          contents.c.child_name,
+                          contents.c.bytes,
+                          contents.c.adler32,
+                          contents.c.guid,
+                          contents.c.events,
                           models.DataIdentifier.lumiblocknr).\
-                    with_hint(models.DataIdentifierAssociation,
-                              "INDEX_RS_ASC(DIDS DIDS_PK) INDEX_RS_ASC(CONTENTS CONTENTS_PK) NO_INDEX_FFS(CONTENTS CONTENTS_PK)",
-                              "oracle").\
-                    filter(and_(models.DataIdentifier.scope == models.DataIdentifierAssociation.child_scope,
-                                models.DataIdentifier.name == models.DataIdentifierAssociation.child_name))
+                    join(models.DataIdentifier, and_(models.DataIdentifier.scope == contents.c.child_scope,
+                                                     models.DataIdentifier.name == contents.c.child_name)).\
+                    filter(contents.c.child_type == DIDType.FILE)
+
+                for child_scope, child_name, bytes, adler32, guid, events, lumiblocknr in query.yield_per(500):
+                    yield {'scope': child_scope, 'name': child_name,
+                           'bytes': bytes, 'adler32': adler32,
+                           'guid': guid and guid.upper(),
+                           'events': events,
+                           'lumiblocknr': lumiblocknr}
             else:
-                dst_cnt_query = session.\
-                    query(models.DataIdentifierAssociation.child_scope,
-                          models.DataIdentifierAssociation.child_name,
-                          models.DataIdentifierAssociation.child_type,
-                          models.DataIdentifierAssociation.bytes,
-                          models.DataIdentifierAssociation.adler32,
-                          models.DataIdentifierAssociation.guid,
-                          models.DataIdentifierAssociation.events,
-                          bindparam("lumiblocknr", None)).\
-                    with_hint(models.DataIdentifierAssociation,
-                              "INDEX(CONTENTS CONTENTS_PK)", 'oracle')
-
-            dids = [(scope, name, did[7]), ]
-            while dids:
-                s, n, t = dids.pop()
-                if t == DIDType.DATASET:
-                    query = dst_cnt_query.\
-                        filter(and_(models.DataIdentifierAssociation.scope == s,
-                                    models.DataIdentifierAssociation.name == n))
-
-                    for child_scope, child_name, child_type, bytes, adler32, guid, events, lumiblocknr in query.yield_per(500):
-                        if long:
-                            yield {'scope': child_scope, 'name': child_name,
-                                   'bytes': bytes, 'adler32': adler32,
-                                   'guid': guid and guid.upper(),
-                                   'events': events,
-                                   'lumiblocknr': lumiblocknr}
-                        else:
-                            yield {'scope': child_scope, 'name': child_name,
-                                   'bytes': bytes, 'adler32': adler32,
-                                   'guid': guid and guid.upper(),
-                                   'events': events}
-                else:
-                    for child_scope, child_name, child_type in cnt_query.filter_by(scope=s, name=n).yield_per(500):
-                        dids.append((child_scope, child_name, child_type))
+                query = session.\
+                    query(contents.c.child_scope,
+                          contents.c.child_name,
+                          contents.c.bytes,
+                          contents.c.adler32,
+                          contents.c.guid,
+                          contents.c.events).\
+                    filter(contents.c.child_type == DIDType.FILE)
+
+                for child_scope, child_name, bytes, adler32, guid, events in query.yield_per(500):
+                    yield {'scope': child_scope, 'name': child_name,
+                           'bytes': bytes, 'adler32': adler32,
+                           'guid': guid and guid.upper(),
+                           'events': events}
 
     except NoResultFound:
         raise exception.DataIdentifierNotFound("Data identifier '%(scope)s:%(name)s' not found" % locals())
@@ -1132,24 +1376,46 @@ def scope_list(scope, name=None, recursive=False, session=None):
     #    yield {'scope': did.scope, 'name': did.name, 'type': did.did_type, 'parent': None, 'level': 0}
 
     def __topdids(scope):
-        c = session.query(models.DataIdentifierAssociation.child_name).filter_by(scope=scope, child_scope=scope)
+        # Anti-join on the contents of the scope instead of a NOT IN list of all their children
+        c = exists().where(and_(models.DataIdentifierAssociation.scope == scope,
+                                models.DataIdentifierAssociation.child_scope == scope,
+                                models.DataIdentifierAssociation.child_name == models.DataIdentifier.name))
         q = session.query(models.DataIdentifier.name, models.DataIdentifier.did_type, models.DataIdentifier.bytes).filter_by(scope=scope)  # add type
-        s = q.filter(not_(models.DataIdentifier.name.in_(c))).order_by(models.DataIdentifier.name)
-        for row in s.yield_per(5):
+        s = q.filter(not_(c)).order_by(models.DataIdentifier.name)
+        for row in s.yield_per(1000):
             if row.did_type == DIDType.FILE:
                 yield {'scope': scope, 'name': row.name, 'type': row.did_type, 'parent': None, 'level': 0, 'bytes': row.bytes}
             else:
                 yield {'scope': scope, 'name': row.name, 'type': row.did_type, 'parent': None, 'level': 0, 'bytes': None}
 
+    # Collections reachable through several parents are only listed once per call
+    children_cache = {}
+
+    def __children(scope, name):
+        if (scope, name) not in children_cache:
+            query_associ = session.query(models.DataIdentifierAssociation.child_scope,
+                                         models.DataIdentifierAssociation.child_name,
+                                         models.DataIdentifierAssociation.child_type).filter_by(scope=scope, name=name)
+            children = query_associ.order_by(models.DataIdentifierAssociation.child_name).all()
+            if not recursive:
+                return children
+            children_cache[(scope, name)] = children
+        return children_cache[(scope, name)]
+
     def __diddriller(pdid):
-        query_associ = session.query(models.DataIdentifierAssociation).filter_by(scope=pdid['scope'], name=pdid['name'])
-        for row in query_associ.order_by('child_name').yield_per(5):
+        # Depth-first walk with an explicit stack of (parent, children) iterators instead of nested generators
+        stack = [(pdid, iter(__children(pdid['scope'], pdid['name'])))]
+        while stack:
+            pdid, children = stack[-1]
+            row = next(children, None)
+            if row is None:
+                stack.pop()
+                continue
             parent = {'scope': pdid['scope'], 'name': pdid['name']}
             cdid = {'scope': row.child_scope, 'name': row.child_name, 'type': row.child_type, 'parent': parent, 'level': pdid['level'] + 1}
             yield cdid
             if cdid['type'] != DIDType.FILE and recursive:
-                for did in __diddriller(cdid):
-                    yield did
+                stack.append((cdid, iter(__children(cdid['scope'], cdid['name']))))
 
     if name is None:
         topdids = __topdids(scope)
@@ -1190,7 +1456,7 @@ def get_did(scope, name, dynamic=False, session=None):
                     'md5': result.md5, 'adler32': result.adler32}
         else:
             if dynamic:
-                bytes, length, events = __resolve_bytes_length_events_did(scope=scope, name=name, session=session)
+                bytes, length, events = __resolve_bytes_length_events_did(scope=scope, name=name, did=result, session=session)
                 # replace None value for bytes with zero
                 if bytes is None:
                     bytes = 0
@@ -1218,32 +1484,31 @@ def get_files(files, session=None):
                                 models.DataIdentifier.adler32, models.DataIdentifier.md5).\
         filter(models.DataIdentifier.did_type == DIDType.FILE).\
         with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle')
-    file_condition = []
+    requested_files = {}
     for file in files:
-        file_condition.append(and_(models.DataIdentifier.scope == file['scope'], models.DataIdentifier.name == file['name']))
+        requested_files[file['scope'], file['name']] = file
 
     rows = []
-    for row in files_query.filter(or_(*file_condition)):
-        file = row._asdict()
-        rows.append(file)
-        if file['availability'] == DIDAvailability.LOST:
-            raise exception.UnsupportedOperation('File %s:%s is LOST and cannot be attached' % (file['scope'], file['name']))
-        # Check meta-data, if provided
-        for f in files:
-            if f['name'] == file['name'] and f['scope'] == file['scope']:
-                for key in ['bytes', 'adler32', 'md5']:
-                    if key in f and str(f.get(key)) != str(file[key]):
-                        raise exception.FileConsistencyMismatch(key + " mismatch for '%(scope)s:%(name)s': " % file + str(f.get(key)) + '!=' + str(file[key]))
-                break
+    for clause in _composite_key_clauses((models.DataIdentifier.scope, models.DataIdentifier.name), list(requested_files)):
+        for row in files_query.filter(clause):
+            if row.availability == DIDAvailability.LOST:
+                raise exception.UnsupportedOperation('File %s:%s is LOST and cannot be attached' % (row.scope, row.name))
+            # Check meta-data, if provided
+            f = requested_files.get((row.scope, row.name))
+            if f is not None:
+                for key in ('bytes', 'adler32', 'md5'):
+                    if key not in f:
+                        continue
+                    # Compare natively first, only coerce to string if the values differ
+                    requested_value, value = f[key], getattr(row, key)
+                    if requested_value != value and str(requested_value) != str(value):
+                        raise exception.FileConsistencyMismatch(key + " mismatch for '%s:%s': " % (row.scope, row.name) + str(requested_value) + '!=' + str(value))
+            rows.append(row._asdict())
 
     if len(rows) != len(files):
+        found_files = set((row['scope'], row['name']) for row in rows)
         for file in files:
-            found = False
-            for row in rows:
-                if row['scope'] == file['scope'] and row['name'] == file['name']:
-                    found = True
-                    break
-            if not found:
+            if (file['scope'], file['name']) not in found_files:
                 raise exception.DataIdentifierNotFound("Data identifier '%(scope)s:%(name)s' not found" % file)
     return rows
 
@@ -1300,18 +1565,22 @@ def get_metadata_bulk(dids, session=None):
     :param dids: A list of dids.
     :param session: The database session in use.
     """
-    condition = []
-    for did in dids:
-        condition.append(and_(models.DataIdentifier.scope == did['scope'],
-                              models.DataIdentifier.name == did['name']))
+    did_keys = [(did['scope'], did['name']) for did in dids]
 
+    # Select the plain columns, no DataIdentifier objects are needed to build the dictionaries
+    query = session.query(*models.DataIdentifier.__table__.columns).with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle')
     try:
-        for chunk in chunks(condition, 50):
-            for row in session.query(models.DataIdentifier).with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').filter(or_(*chunk)):
-                data = {}
-                for column in row.__table__.columns:
-                    data[column.name] = getattr(row, column.name)
-                yield data
+        if len(did_keys) == 1:
+            # Plain primary key lookup for a single did
+            scope, name = did_keys[0]
+            for row in query.filter(models.DataIdentifier.scope == scope, models.DataIdentifier.name == name):
+                yield row._asdict()
+            return
+
+        # A single (scope, name) IN list per chunk instead of one OR branch per did
+        for clause in _composite_key_clauses((models.DataIdentifier.scope, models.DataIdentifier.name), did_keys):
+            for row in query.filter(clause):
+                yield row._asdict()
     except NoResultFound:
         raise exception.DataIdentifierNotFound('No Data Identifiers found')
 
@@ -1353,7 +1622,8 @@ def set_status(scope, name, session=None, **kwargs):
                 values['is_open'], values['closed_at'] = False, datetime.utcnow()
                 values['bytes'], values['length'], values['events'] = __resolve_bytes_length_events_did(scope=scope, name=name, session=session)
                 # Update datasetlocks as well
-                session.query(models.DatasetLock).filter_by(scope=scope, name=name).update({'length': values['length'], 'bytes': values['bytes']})
+                session.query(models.DatasetLock).filter_by(scope=scope, name=name).\
+                    update({'length': values['length'], 'bytes': values['bytes']}, synchronize_session=False)
 
                 # Generate a message
                 message = {'scope': scope.external,
@@ -1376,10 +1646,12 @@ def set_status(scope, name, session=None, **kwargs):
                     message['vo'] = scope.vo
                 add_message('OPEN', message, session=session)
 
-    rowcount = query.update(values, synchronize_session='fetch')
+    # The criteria are plain comparisons, so the session can be synchronised in Python without selecting the rows first
+    rowcount = query.update(values, synchronize_session='evaluate')
 
     if not rowcount:
-        query = session.query(models.DataIdentifier).filter_by(scope=scope, name=name)
+        query = session.query(models.DataIdentifier.scope).filter_by(scope=scope, name=name).\
+            with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle')
         try:
             query.one()
         except NoResultFound:
@@ -1388,7 +1660,10 @@ def set_status(scope, name, session=None, **kwargs):
     else:
         # Generate callbacks
         if not values['is_open']:
-            rules_on_ds = session.query(models.ReplicationRule).filter_by(scope=scope, name=name).all()
+            # Only rules which are OK and have notifications enabled can generate a callback here
+            rules_on_ds = session.query(models.ReplicationRule).filter_by(scope=scope, name=name).\
+                filter(models.ReplicationRule.state == RuleState.OK,
+                       models.ReplicationRule.notification != RuleNotification.NO).all()
             for rule in rules_on_ds:
                 rucio.core.rule.generate_rule_notifications(rule=rule, session=session)
 
@@ -1541,7 +1816,7 @@ def get_did_atime(scope, name, session=None):
 
     :returns: A datetime timestamp with the last access time.
     """
-    return session.query(models.DataIdentifier.accessed_at).filter_by(scope=scope, name=name).one()[0]
+    return get_did_access_info(scope=scope, name=name, session=session)[0]
 
 
 @read_session
@@ -1554,7 +1829,22 @@ def get_did_access_cnt(scope, name, session=None):
 
     :returns: A datetime timestamp with the last access time.
     """
-    return session.query(models.DataIdentifier.access_cnt).filter_by(scope=scope, name=name).one()[0]
+    return get_did_access_info(scope=scope, name=name, session=session)[1]
+
+
+@read_session
+def get_did_access_info(scope, name, session=None):
+    """
+    Get the accessed_at timestamp and the access_cnt for a did in a single query.
+    :param scope: the scope name.
+    :param name: The data identifier name.
+    :param session: Database session to use.
+
+    :returns: A tuple (accessed_at, access_cnt).
+    """
+    return tuple(session.query(models.DataIdentifier.accessed_at, models.DataIdentifier.access_cnt).
+                 with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').
+                 filter_by(scope=scope, name=name).one())
 
 
 @stream_session
@@ -1566,17 +1856,25 @@ def get_dataset_by_guid(guid, session=None):
 
     :returns: A did.
     """
-    query = session.query(models.DataIdentifier).filter_by(guid=guid, did_type=DIDType.FILE).with_hint(models.ReplicaLock, "INDEX(DIDS_GUIDS_IDX)", 'oracle')
-    try:
-        r = query.one()
-        datasets = session.query(models.DataIdentifierAssociation.scope, models.DataIdentifierAssociation.name).filter_by(child_scope=r.scope, child_name=r.name).\
-            with_hint(models.DataIdentifierAssociation,
-                      "INDEX(CONTENTS CONTENTS_CHILD_SCOPE_NAME_IDX)", 'oracle')
-    except NoResultFound:
-        raise exception.DataIdentifierNotFound("No file associated to GUID : %s" % guid)
-    for tmp_did in datasets.yield_per(5):
+    # Resolve the file and its parent datasets with a single join
+    datasets = session.query(models.DataIdentifierAssociation.scope, models.DataIdentifierAssociation.name).\
+        join(models.DataIdentifier, and_(models.DataIdentifier.scope == models.DataIdentifierAssociation.child_scope,
+                                         models.DataIdentifier.name == models.DataIdentifierAssociation.child_name)).\
+        filter(models.DataIdentifier.guid == guid, models.DataIdentifier.did_type == DIDType.FILE).\
+        with_hint(models.ReplicaLock, "INDEX(DIDS_GUIDS_IDX)", 'oracle').\
+        with_hint(models.DataIdentifierAssociation,
+                  "INDEX(CONTENTS CONTENTS_CHILD_SCOPE_NAME_IDX)", 'oracle')
+    found = False
+    for tmp_did in datasets.yield_per(100):
+        found = True
         yield {'scope': tmp_did.scope, 'name': tmp_did.name}
 
+    if not found:
+        # Only a missing file is an error, a file without parent datasets is not
+        query = session.query(models.DataIdentifier.scope, models.DataIdentifier.name).filter_by(guid=guid, did_type=DIDType.FILE).with_hint(models.ReplicaLock, "INDEX(DIDS_GUIDS_IDX)", 'oracle')
+        if query.first() is None:
+            raise exception.DataIdentifierNotFound("No file associated to GUID : %s" % guid)
+
 
 @transactional_session
 def touch_dids(dids, session=None):
@@ -1590,15 +1888,13 @@ def touch_dids(dids, session=None):
     """
 
     now = datetime.utcnow()
-    none_value = None
+    # One executemany of the same UPDATE instead of a statement per did
+    params = [{'b_scope': did['scope'], 'b_name': did['name'], 'b_did_type': did['type'],
+               'b_accessed_at': did.get('accessed_at') or now} for did in dids]
+    if not params:
+        return True
     try:
-        for did in dids:
-            session.query(models.DataIdentifier).\
-                filter_by(scope=did['scope'], name=did['name'], did_type=did['type']).\
-                update({'accessed_at': did.get('accessed_at') or now,
-                        'access_cnt': case([(models.DataIdentifier.access_cnt == none_value, 1)],
-                                           else_=(models.DataIdentifier.access_cnt + 1))},
-                       synchronize_session=False)
+        session.connection().execution_options(compiled_cache=COMPILED_CACHE).execute(TOUCH_DIDS_STMT, params)
     except DatabaseError:
         return False
 
@@ -1618,55 +1914,87 @@ def create_did_sample(input_scope, input_name, output_scope, output_name, accoun
     :param nbfiles: The number of files to register in the output dataset.
     :param session: The database session in use.
     """
-    files = [did for did in list_files(scope=input_scope, name=input_name, long=False, session=session)]
-    random.shuffle(files)
-    output_files = files[:int(nbfiles)]
+    try:
+        input_type = session.query(models.DataIdentifier.did_type).\
+            filter_by(scope=input_scope, name=input_name).\
+            with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').\
+            one()[0]
+    except NoResultFound:
+        raise exception.DataIdentifierNotFound("Data identifier '%s:%s' not found" % (input_scope, input_name))
+
+    if input_type == DIDType.DATASET:
+        # Let the database draw the sample instead of listing and shuffling all the files of the dataset
+        if session.bind.dialect.name == 'oracle':
+            random_order = func.dbms_random.value()
+        elif session.bind.dialect.name == 'mysql':
+            random_order = func.rand()
+        else:
+            random_order = func.random()
+        query = session.query(models.DataIdentifierAssociation.child_scope,
+                              models.DataIdentifierAssociation.child_name,
+                              models.DataIdentifierAssociation.bytes,
+                              models.DataIdentifierAssociation.adler32,
+                              models.DataIdentifierAssociation.guid,
+                              models.DataIdentifierAssociation.events).\
+            with_hint(models.DataIdentifierAssociation, "INDEX(CONTENTS CONTENTS_PK)", 'oracle').\
+            filter_by(scope=input_scope, name=input_name, child_type=DIDType.FILE).\
+            order_by(random_order).\
+            limit(int(nbfiles))
+        output_files = [{'scope': child_scope, 'name': child_name, 'bytes': bytes, 'adler32': adler32,
+                         'guid': guid and guid.upper(), 'events': events}
+                        for child_scope, child_name, bytes, adler32, guid, events in query]
+    else:
+        files = [did for did in list_files(scope=input_scope, name=input_name, long=False, session=session)]
+        random.shuffle(files)
+        output_files = files[:int(nbfiles)]
     add_did(scope=output_scope, name=output_name, type=DIDType.DATASET, account=account, statuses={}, meta=[], rules=[], lifetime=None, dids=[], rse_id=None, session=session)
     attach_dids(scope=output_scope, name=output_name, dids=output_files, account=account, rse_id=None, session=session)
 
 
 @transactional_session
-def __resolve_bytes_length_events_did(scope, name, session):
+def __resolve_bytes_length_events_did(scope, name, session, did=None):
     """
     Resolve bytes, length and events of a did
 
     :param scope:   The scope of the DID.
     :param name:    The name of the DID.
     :param session: The database session in use.
+    :param did:     The DID row if already loaded by the caller, to avoid looking it up again.
     """
 
-    try:
-        did = session.query(models.DataIdentifier).filter_by(scope=scope, name=name).one()
-    except NoResultFound:
-        raise exception.DataIdentifierNotFound("Data identifier '%s:%s' not found" % (scope, name))
-
-    bytes, length, events = 0, 0, 0
-    if did.did_type == DIDType.FILE:
-        bytes, length, events = did.bytes, 1, did.events
-    elif did.did_type == DIDType.DATASET:
+    if did is None:
         try:
-            length, bytes, events = session.query(func.count(models.DataIdentifierAssociation.scope),
-                                                  func.sum(models.DataIdentifierAssociation.bytes),
-                                                  func.sum(models.DataIdentifierAssociation.events)).\
+            did = session.query(models.DataIdentifier.did_type,
+                                models.DataIdentifier.bytes,
+                                models.DataIdentifier.events).\
                 filter_by(scope=scope, name=name).\
+                with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').\
                 one()
         except NoResultFound:
-            length, bytes, events = 0, 0, 0
+            raise exception.DataIdentifierNotFound("Data identifier '%s:%s' not found" % (scope, name))
+
+    def __aggregate_contents(*criterion):
+        # An aggregate without GROUP BY always returns exactly one row
+        return session.query(func.count(models.DataIdentifierAssociation.scope),
+                             func.coalesce(func.sum(models.DataIdentifierAssociation.bytes), 0),
+                             func.coalesce(func.sum(models.DataIdentifierAssociation.events), 0)).\
+            filter(*criterion).\
+            one()
 
+    bytes, length, events = 0, 0, 0
+    if did.did_type == DIDType.FILE:
+        bytes, length, events = did.bytes, 1, did.events
+    elif did.did_type == DIDType.DATASET:
+        length, bytes, events = __aggregate_contents(models.DataIdentifierAssociation.scope == scope,
+                                                     models.DataIdentifierAssociation.name == name)
     elif did.did_type == DIDType.CONTAINER:
-        for dataset in list_child_datasets(scope=scope, name=name, session=session):
-            try:
-                tmp_length, tmp_bytes, tmp_events = session.query(func.count(models.DataIdentifierAssociation.scope),
-                                                                  func.sum(models.DataIdentifierAssociation.bytes),
-                                                                  func.sum(models.DataIdentifierAssociation.events)).\
-                    filter_by(scope=dataset['scope'], name=dataset['name']).\
-                    one()
-            except NoResultFound:
-                tmp_length, tmp_bytes, tmp_events = 0, 0, 0
-
-            bytes += tmp_bytes or 0
-            length += tmp_length or 0
-            events += tmp_events or 0
+        # Aggregate the contents of many child datasets per query instead of one query per dataset
+        dataset_keys = [(dataset['scope'], dataset['name']) for dataset in list_child_datasets(scope=scope, name=name, session=session)]
+        for clause in _composite_key_clauses((models.DataIdentifierAssociation.scope, models.DataIdentifierAssociation.name), dataset_keys):
+            tmp_length, tmp_bytes, tmp_events = __aggregate_contents(clause)
+            bytes += tmp_bytes
+            length += tmp_length
+            events += tmp_events
     return (bytes, length, events)
 
 
@@ -1678,40 +2006,47 @@ def resurrect(dids, session=None):
     :param dids: The list of dids to resurrect.
     :param session: The database session in use.
     """
-    for did in dids:
-        try:
-            del_did = session.query(models.DeletedDataIdentifier).\
-                with_hint(models.DeletedDataIdentifier,
-                          "INDEX(DELETED_DIDS DELETED_DIDS_PK)", 'oracle').\
-                filter_by(scope=did['scope'], name=did['name']).\
-                one()
-        except NoResultFound:
-            # Dataset might still exist, but could have an expiration date, if it has, remove it
-            rowcount = session.query(models.DataIdentifier).filter(models.DataIdentifier.scope == did['scope'],
-                                                                   models.DataIdentifier.name == did['name'],
-                                                                   models.DataIdentifier.expired_at < datetime.utcnow()).\
-                update({'expired_at': None}, synchronize_session=False)
-            if rowcount:
-                continue
-            raise exception.DataIdentifierNotFound("Deleted Data identifier '%(scope)s:%(name)s' not found" % did)
+    did_keys = list(dict.fromkeys((did['scope'], did['name']) for did in dids))
+    deleted_columns = [column.name for column in models.DeletedDataIdentifier.__table__.columns if column.name != 'expired_at']
+    now = datetime.utcnow()
 
-        # Check did_type
-        # if del_did.did_type  == DIDType.FILE:
-        #    raise exception.UnsupportedOperation("File '%(scope)s:%(name)s' cannot be resurrected" % did)
+    # Validate all the dids up front so that nothing is modified if one of them cannot be resurrected
+    found_deleted_keys = set()
+    for clause in _composite_key_clauses((models.DeletedDataIdentifier.scope, models.DeletedDataIdentifier.name), did_keys):
+        found_deleted_keys.update(session.query(models.DeletedDataIdentifier.scope, models.DeletedDataIdentifier.name).
+                                  with_hint(models.DeletedDataIdentifier, "INDEX(DELETED_DIDS DELETED_DIDS_PK)", 'oracle').
+                                  filter(clause))
+    deleted_keys = [key for key in did_keys if key in found_deleted_keys]
+
+    # Dataset might still exist, but could have an expiration date, if it has, remove it
+    expired_keys = [key for key in did_keys if key not in found_deleted_keys]
+    found_expired_keys = set()
+    for clause in _composite_key_clauses((models.DataIdentifier.scope, models.DataIdentifier.name), expired_keys):
+        found_expired_keys.update(session.query(models.DataIdentifier.scope, models.DataIdentifier.name).
+                                  filter(clause).
+                                  filter(models.DataIdentifier.expired_at < now))
+    for scope, name in expired_keys:
+        if (scope, name) not in found_expired_keys:
+            raise exception.DataIdentifierNotFound("Deleted Data identifier '%s:%s' not found" % (scope, name))
+
+    for clause in _composite_key_clauses((models.DataIdentifier.scope, models.DataIdentifier.name), expired_keys):
+        session.query(models.DataIdentifier).\
+            filter(clause).\
+            filter(models.DataIdentifier.expired_at < now).\
+            update({'expired_at': None}, synchronize_session=False)
 
-        kargs = del_did.to_dict()
-        if kargs['expired_at']:
-            kargs['expired_at'] = None
-        kargs.pop("_sa_instance_state", None)
+    # Move the deleted dids back in one INSERT ... SELECT per chunk, their expiration date is dropped
+    for deleted_clause in _composite_key_clauses((models.DeletedDataIdentifier.scope, models.DeletedDataIdentifier.name), deleted_keys):
+        stmt = models.DataIdentifier.__table__.insert().\
+            from_select(deleted_columns,
+                        select([models.DeletedDataIdentifier.__table__.c[column] for column in deleted_columns]).where(deleted_clause))
+        session.execute(stmt)
 
         session.query(models.DeletedDataIdentifier).\
             with_hint(models.DeletedDataIdentifier,
                       "INDEX(DELETED_DIDS DELETED_DIDS_PK)", 'oracle').\
-            filter_by(scope=did['scope'], name=did['name']).\
-            delete()
-
-        models.DataIdentifier(**kargs).\
-            save(session=session, flush=False)
+            filter(deleted_clause).\
+            delete(synchronize_session=False)
 
 
 @stream_session
@@ -1724,12 +2059,16 @@ def list_archive_content(scope, name, session=None):
     :param session: The database session in use.
     """
     try:
-        query = session.query(models.ConstituentAssociation).\
+        query = session.query(models.ConstituentAssociation.child_scope,
+                              models.ConstituentAssociation.child_name,
+                              models.ConstituentAssociation.bytes,
+                              models.ConstituentAssociation.adler32,
+                              models.ConstituentAssociation.md5).\
             with_hint(models.ConstituentAssociation,
                       "INDEX(ARCHIVE_CONTENTS ARCH_CONTENTS_PK)", 'oracle').\
             filter_by(scope=scope, name=name)
 
-        for tmp_did in query.yield_per(5):
+        for tmp_did in query.yield_per(500):
             yield {'scope': tmp_did.child_scope, 'name': tmp_did.child_name,
                    'bytes': tmp_did.bytes, 'adler32': tmp_did.adler32, 'md5': tmp_did.md5}
     except NoResultFound:
@@ -1759,16 +2098,25 @@ def add_dids_to_followed(dids, account, session=None):
     :param account: The account owner.
     :param session: The database session in use.
     """
-    try:
-        for did in dids:
-            # Get the did details corresponding to the scope and name passed.
-            did = session.query(models.DataIdentifier).filter_by(scope=did['scope'], name=did['name']).one()
-            # Add the queried to the followed table.
-            new_did_followed = models.DidsFollowed(scope=did.scope, name=did.name, account=account,
-                                                   did_type=did.did_type)
+    did_keys = [(did['scope'], did['name']) for did in dids]
 
-            new_did_followed.save(session=session, flush=False)
+    # Get the did types of all the dids passed with one query per chunk.
+    did_types = {}
+    for clause in _composite_key_clauses((models.DataIdentifier.scope, models.DataIdentifier.name), list(set(did_keys))):
+        query = session.query(models.DataIdentifier.scope, models.DataIdentifier.name, models.DataIdentifier.did_type).\
+            filter(clause)
+        for scope, name, did_type in query:
+            did_types[(scope, name)] = did_type
 
+    followed = []
+    for scope, name in did_keys:
+        if (scope, name) not in did_types:
+            raise exception.DataIdentifierNotFound("Data identifier '%s:%s' not found" % (scope, name))
+        followed.append({'scope': scope, 'name': name, 'account': account, 'did_type': did_types[(scope, name)]})
+
+    try:
+        # Add the queried to the followed table.
+        followed and session.bulk_insert_mappings(models.DidsFollowed, followed)
         session.flush()
     except IntegrityError as error:
         raise exception.RucioException(error.args)
@@ -1784,9 +2132,9 @@ def get_users_following_did(scope, name, session=None):
     :param session: The database session in use.
     """
     try:
-        query = session.query(models.DidsFollowed).filter_by(scope=scope, name=name).all()
+        query = session.query(models.DidsFollowed.account).filter_by(scope=scope, name=name)
 
-        for user in query:
+        for user in query.yield_per(200):
             # Return a dictionary of users to be rendered as json.
             yield {'user': user.account}
 
@@ -1817,13 +2165,11 @@ def remove_dids_from_followed(dids, account, session=None):
     :param account: The account owner.
     :param session: The database session in use.
     """
-    try:
-        for did in dids:
-            session.query(models.DidsFollowed).\
-                filter_by(scope=did['scope'], name=did['name'], account=account).\
-                delete(synchronize_session=False)
-    except NoResultFound:
-        raise exception.DataIdentifierNotFound("Data identifier '%s:%s' not found" % (did['scope'], did['name']))
+    did_keys = list(dict.fromkeys((did['scope'], did['name']) for did in dids))
+    for clause in _composite_key_clauses((models.DidsFollowed.scope, models.DidsFollowed.name), did_keys):
+        session.query(models.DidsFollowed).\
+            filter(models.DidsFollowed.account == account, clause).\
+            delete(synchronize_session=False)
 
 
 @transactional_session
@@ -1838,63 +2184,76 @@ def trigger_event(scope, name, event_type, payload, session=None):
     :param session: The database session in use.
     """
     try:
-        dids = session.query(models.DidsFollowed).filter_by(scope=scope, name=name).all()
-
-        for did in dids:
-            # Create a new event using teh specified parameters.
-            new_event = models.FollowEvents(scope=scope, name=name, account=did.account,
-                                            did_type=did.did_type, event_type=event_type, payload=payload)
-            new_event.save(session=session, flush=False)
-
-        session.flush()
+        # Create a new event for every follower of the did with a single INSERT ... SELECT.
+        followers = select([models.DidsFollowed.scope,
+                            models.DidsFollowed.name,
+                            models.DidsFollowed.account,
+                            models.DidsFollowed.did_type,
+                            literal(event_type, type_=models.FollowEvents.event_type.type).label('event_type'),
+                            literal(payload, type_=models.FollowEvents.payload.type).label('payload')]).\
+            where(and_(models.DidsFollowed.scope == scope,
+                       models.DidsFollowed.name == name))
+        stmt = models.FollowEvents.__table__.insert().\
+            from_select(['scope', 'name', 'account', 'did_type', 'event_type', 'payload'], followers)
+        session.execute(stmt)
     except IntegrityError as error:
         raise exception.RucioException(error.args)
 
 
-@read_session
+@transactional_session
 def create_reports(total_workers, worker_number, session=None):
     """
     Create a summary report of the events affecting a dataset, for its followers.
 
     :param session: The database session in use.
     """
-    # Query the FollowEvents table
-    query = session.query(models.FollowEvents)
+    # Query the FollowEvents table, only the columns used in the report
+    query = session.query(models.FollowEvents.scope,
+                          models.FollowEvents.name,
+                          models.FollowEvents.account,
+                          models.FollowEvents.event_type,
+                          models.FollowEvents.payload)
 
     # Use hearbeat mechanism to select a chunck of events based on the hashed account
     query = filter_thread_work(session=session, query=query, total_threads=total_workers, thread_id=worker_number, hash_variable='account')
 
-    try:
-        events = query.order_by(models.FollowEvents.created_at).all()
-        # If events exist for an account then create a report.
-        if events:
-            body = '''
+    # Group the streamed events per account, keeping their creation order
+    account_events = {}
+    for event in query.order_by(models.FollowEvents.created_at).yield_per(500):
+        account_events.setdefault(event.account, []).append(event)
+
+    # Get the emails associated with all the accounts at once.
+    emails = {}
+    for chunk in chunks(list(account_events), KEY_CHUNK_SIZE):
+        for account, email in session.query(models.Account.account, models.Account.email).filter(models.Account.account.in_(chunk)):
+            emails[account] = email
+
+    # If events exist for an account then create a report for that account.
+    for account, events in account_events.items():
+        # Build the message body, joined once at the end
+        body = ['''
                 Hello,
                 This is an auto-generated report of the events that have affected the datasets you follow.
 
-                '''
-            account = None
-            for i, event in enumerate(events):
-                # Add each event to the message body.
-                body += "{}. Dataset: {} Event: {}\n".format(i + 1, event.name, event.event_type)
-                if event.payload:
-                    body += "Message: {}\n".format(event.payload)
-                body += "\n"
-                account = event.account
-                # Clean up the event after creating the report
-                session.query(models.FollowEvents).\
-                    filter_by(scope=event.scope, name=event.name, account=event.account).\
-                    delete(synchronize_session=False)
-
-            body += "Thank You."
-            # Get the email associated with the account.
-            email = session.query(models.Account.email).filter_by(account=account)
-            add_message('email', {'to': email,
-                                  'subject': 'Report of affected dataset(s)',
-                                  'body': body})
+                ''']
+        for i, event in enumerate(events):
+            # Add each event to the message body.
+            body.append("{}. Dataset: {} Event: {}\n".format(i + 1, event.name, event.event_type))
+            if event.payload:
+                body.append("Message: {}\n".format(event.payload))
+            body.append("\n")
+        body.append("Thank You.")
+
+        # Clean up the events after creating the report, with one delete per chunk
+        event_keys = list(dict.fromkeys((event.scope, event.name) for event in events))
+        for clause in _composite_key_clauses((models.FollowEvents.scope, models.FollowEvents.name), event_keys):
+            session.query(models.FollowEvents).\
+                filter(models.FollowEvents.account == account, clause).\
+                delete(synchronize_session=False)
 
-    except NoResultFound:
-        raise exception.AccountNotFound("No email found for given account.")
+        add_message('email', {'to': emails.get(account),
+                              'subject': 'Report of affected dataset(s)',
+                              'body': ''.join(body)}, session=session)
 
 
 @transactional_session
@@ -1906,44 +2265,20 @@ def insert_content_history(content_clause, did_created_at, session=None):
     :param did_created_at: Creation date of the did
     :param session: The database session in use.
     """
-    new_did_created_at = did_created_at
-    query = session.query(models.DataIdentifierAssociation.scope,
-                          models.DataIdentifierAssociation.name,
-                          models.DataIdentifierAssociation.child_scope,
-                          models.DataIdentifierAssociation.child_name,
-                          models.DataIdentifierAssociation.did_type,
-                          models.DataIdentifierAssociation.child_type,
-                          models.DataIdentifierAssociation.bytes,
-                          models.DataIdentifierAssociation.adler32,
-                          models.DataIdentifierAssociation.md5,
-                          models.DataIdentifierAssociation.guid,
-                          models.DataIdentifierAssociation.events,
-                          models.DataIdentifierAssociation.rule_evaluation,
-                          models.DataIdentifierAssociation.created_at,
-                          models.DataIdentifierAssociation.updated_at).\
-        filter(or_(*content_clause))
-
-    for cont in query.all():
-        if not did_created_at:
-            new_did_created_at = cont.created_at
-        models.DataIdentifierAssociationHistory(
-            scope=cont.scope,
-            name=cont.name,
-            child_scope=cont.child_scope,
-            child_name=cont.child_name,
-            did_type=cont.did_type,
-            child_type=cont.child_type,
-            bytes=cont.bytes,
-            adler32=cont.adler32,
-            md5=cont.md5,
-            guid=cont.guid,
-            events=cont.events,
-            rule_evaluation=cont.rule_evaluation,
-            updated_at=cont.updated_at,
-            created_at=cont.created_at,
-            did_created_at=new_did_created_at,
-            deleted_at=datetime.utcnow()
-        ).save(session=session, flush=False)
+    # Copy the rows with a single INSERT ... SELECT instead of fetching them into Python
+    columns = ['scope', 'name', 'child_scope', 'child_name', 'did_type', 'child_type', 'bytes', 'adler32',
+               'md5', 'guid', 'events', 'rule_evaluation', 'created_at', 'updated_at']
+    select_columns = [getattr(models.DataIdentifierAssociation, column) for column in columns]
+    if did_created_at:
+        select_columns.append(literal(did_created_at, type_=models.DataIdentifierAssociationHistory.did_created_at.type).label('did_created_at'))
+    else:
+        select_columns.append(models.DataIdentifierAssociation.created_at.label('did_created_at'))
+    select_columns.append(literal(datetime.utcnow(), type_=models.DataIdentifierAssociationHistory.deleted_at.type).label('deleted_at'))
+
+    stmt = models.DataIdentifierAssociationHistory.__table__.insert().\
+        from_select(columns + ['did_created_at', 'deleted_at'],
+                    select(select_columns).where(or_(*content_clause)))
+    session.execute(stmt)
 
 
 @transactional_session
@@ -1954,87 +2289,10 @@ def insert_deleted_dids(did_clause, session=None):
     :param did_clause: DID clause of the files to archive
     :param session: The database session in use.
     """
-    query = session.query(models.DataIdentifier.scope,
-                          models.DataIdentifier.name,
-                          models.DataIdentifier.account,
-                          models.DataIdentifier.did_type,
-                          models.DataIdentifier.is_open,
-                          models.DataIdentifier.monotonic,
-                          models.DataIdentifier.hidden,
-                          models.DataIdentifier.obsolete,
-                          models.DataIdentifier.complete,
-                          models.DataIdentifier.is_new,
-                          models.DataIdentifier.availability,
-                          models.DataIdentifier.suppressed,
-                          models.DataIdentifier.bytes,
-                          models.DataIdentifier.length,
-                          models.DataIdentifier.md5,
-                          models.DataIdentifier.adler32,
-                          models.DataIdentifier.expired_at,
-                          models.DataIdentifier.purge_replicas,
-                          models.DataIdentifier.deleted_at,
-                          models.DataIdentifier.events,
-                          models.DataIdentifier.guid,
-                          models.DataIdentifier.project,
-                          models.DataIdentifier.datatype,
-                          models.DataIdentifier.run_number,
-                          models.DataIdentifier.stream_name,
-                          models.DataIdentifier.prod_step,
-                          models.DataIdentifier.version,
-                          models.DataIdentifier.campaign,
-                          models.DataIdentifier.task_id,
-                          models.DataIdentifier.panda_id,
-                          models.DataIdentifier.lumiblocknr,
-                          models.DataIdentifier.provenance,
-                          models.DataIdentifier.phys_group,
-                          models.DataIdentifier.transient,
-                          models.DataIdentifier.accessed_at,
-                          models.DataIdentifier.closed_at,
-                          models.DataIdentifier.eol_at,
-                          models.DataIdentifier.is_archive,
-                          models.DataIdentifier.constituent,
-                          models.DataIdentifier.access_cnt).\
-        filter(or_(*did_clause))
-
-    for did in query.all():
-        models.DeletedDataIdentifier(
-            scope=did.scope,
-            name=did.name,
-            account=did.account,
-            did_type=did.did_type,
-            is_open=did.is_open,
-            monotonic=did.monotonic,
-            hidden=did.hidden,
-            obsolete=did.obsolete,
-            complete=did.complete,
-            is_new=did.is_new,
-            availability=did.availability,
-            suppressed=did.suppressed,
-            bytes=did.bytes,
-            length=did.length,
-            md5=did.md5,
-            adler32=did.adler32,
-            expired_at=did.expired_at,
-            purge_replicas=did.purge_replicas,
-            deleted_at=datetime.utcnow(),
-            events=did.events,
-            guid=did.guid,
-            project=did.project,
-            datatype=did.datatype,
-            run_number=did.run_number,
-            stream_name=did.stream_name,
-            prod_step=did.prod_step,
-            version=did.version,
-            campaign=did.campaign,
-            task_id=did.task_id,
-            panda_id=did.panda_id,
-            lumiblocknr=did.lumiblocknr,
-            provenance=did.provenance,
-            phys_group=did.phys_group,
-            transient=did.transient,
-            accessed_at=did.accessed_at,
-            closed_at=did.closed_at,
-            eol_at=did.eol_at,
-            is_archive=did.is_archive,
-            constituent=did.constituent
-        ).save(session=session, flush=False)
+    # Copy the rows with a single INSERT ... SELECT instead of fetching them into Python
+    select_columns = DELETED_DID_SELECT_COLUMNS + [literal(datetime.utcnow(), type_=models.DeletedDataIdentifier.deleted_at.type).label('deleted_at')]
+
+    stmt = models.DeletedDataIdentifier.__table__.insert().\
+        from_select(DELETED_DID_COLUMNS + ['deleted_at'],
+                    select(select_columns).where(or_(*did_clause)))
+    session.execute(stmt)
@@ -34,7 +34,7 @@
 from datetime import datetime, timedelta
 
 from six import string_types
-from sqlalchemy import or_
+from sqlalchemy import and_, or_, exists
 from sqlalchemy.exc import CompileError, InvalidRequestError
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import func
@@ -208,19 +208,18 @@ class DidColumnMeta(DidMetaPlugin):
             if not rowcount:
                 raise exception.UnsupportedOperation('Some of the keys for %s:%s cannot be updated: %s' % (scope, name, str(list(remainder.keys()))))
 
-            # propagate metadata updates to child content
+            # propagate metadata updates to child content, with a single update of all children
             if recursive:
-                content_query = session.query(models.DataIdentifierAssociation.child_scope, models.DataIdentifierAssociation.child_name)
-                content_query = content_query.with_hint(models.DataIdentifierAssociation, "INDEX(CONTENTS CONTENTS_PK)", 'oracle').filter_by(scope=scope, name=name)
-
-                for child_scope, child_name in content_query:
-                    try:
-                        child_did_query = session.query(models.DataIdentifier).with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').filter_by(scope=child_scope, name=child_name)
-                        child_did_query.update(remainder, synchronize_session='fetch')
-                    except CompileError as error:
-                        raise exception.InvalidMetadata(error)
-                    except InvalidRequestError:
-                        raise exception.InvalidMetadata("Some of the keys are not accepted recursively: " + str(list(remainder.keys())))
+                is_child = exists().where(and_(models.DataIdentifierAssociation.scope == scope,
+                                               models.DataIdentifierAssociation.name == name,
+                                               models.DataIdentifierAssociation.child_scope == models.DataIdentifier.scope,
+                                               models.DataIdentifierAssociation.child_name == models.DataIdentifier.name))
+                try:
+                    session.query(models.DataIdentifier).filter(is_child).update(remainder, synchronize_session='fetch')
+                except CompileError as error:
+                    raise exception.InvalidMetadata(error)
+                except InvalidRequestError:
+                    raise exception.InvalidMetadata("Some of the keys are not accepted recursively: " + str(list(remainder.keys())))
 
     @stream_session
     def list_dids(self, scope, filters, type='collection', ignore_case=False, limit=None,
@@ -60,7 +60,7 @@ def add_identity(identity, type, email, password=None, session=None):
     new_id.update({'identity': identity, 'identity_type': type, 'email': email})
 
     if type == IdentityType.USERPASS:
-        salt = os.urandom(255)  # make sure the salt has the length of the hash
+        salt = os.urandom(32)  # the salt has the length of the sha256 digest
         salted_password = salt + password.encode()
         password = hashlib.sha256(salted_password).hexdigest()  # hash it
         new_id.update({'salt': salt, 'password': password, 'email': email})
@@ -104,12 +104,13 @@ def add_account_identity(identity, type, account, email, default=False, password
     if not account_exists(account, session=session):
         raise exception.AccountNotFound('Account \'%s\' does not exist.' % account)
 
-    id = session.query(models.Identity).filter_by(identity=identity, identity_type=type).first()
+    id = session.query(models.Identity.identity, models.Identity.identity_type).filter_by(identity=identity, identity_type=type).first()
     if id is None:
+        # The new identity has exactly the given key, no need to read it back
         add_identity(identity=identity, type=type, email=email, password=password, session=session)
-        id = session.query(models.Identity).filter_by(identity=identity, identity_type=type).first()
+        id = (identity, type)
 
-    iaa = models.IdentityAccountAssociation(identity=id.identity, identity_type=id.identity_type, account=account,
+    iaa = models.IdentityAccountAssociation(identity=id[0], identity_type=id[1], account=account,
                                             is_default=default)
 
     try:
@@ -197,12 +198,8 @@ def list_identities(session=None, **kwargs):
     returns: A list of all identities.
     """
 
-    id_list = []
-
-    for id in session.query(models.Identity).order_by(models.Identity.identity):
-        id_list.append((id.identity, id.identity_type))
-
-    return id_list
+    query = session.query(models.Identity.identity, models.Identity.identity_type).order_by(models.Identity.identity)
+    return [(identity, identity_type) for identity, identity_type in query]
 
 
 @read_session
@@ -46,18 +46,12 @@ REGION = make_region().configure('dogpile.cache.memcached',
                                             'distributed_lock': True})
 
 
-@transactional_session
-def add_message(event_type, payload, session=None):
+def __get_services_list():
     """
-    Add a message to be submitted asynchronously to a message broker.
-
-    In the case of nolimit, a placeholder string is written to the NOT NULL payload column.
+    Get the list of services the messages should be submitted to, using the cache if possible.
 
-    :param event_type: The type of the event as a string, e.g., NEW_DID.
-    :param payload: The message payload. Will be persisted as JSON.
-    :param session: The database session to use.
+    :returns: The configured services list, None if it is not set.
     """
-
     services_list = REGION.get('services_list')
     if services_list == NO_VALUE:
         try:
@@ -65,20 +59,59 @@ def add_message(event_type, payload, session=None):
         except ConfigNotFound:
             services_list = None
         REGION.set('services_list', services_list)
+    return services_list
 
+
+def __message_values(event_type, payload, services_list):
+    """
+    Build the column values of a message.
+
+    In the case of nolimit, a placeholder string is written to the NOT NULL payload column.
+
+    :param event_type: The type of the event as a string, e.g., NEW_DID.
+    :param payload: The message payload. Will be persisted as JSON.
+    :param services_list: The services the message should be submitted to.
+    :returns: A dictionary with the column values.
+    """
     try:
         payload = json.dumps(payload, cls=APIEncoder)
     except TypeError as e:  # noqa: F841
         raise InvalidObject('Invalid JSON for payload: %(e)s' % locals())
 
     if len(payload) > 4000:
-        new_message = Message(event_type=event_type, payload='nolimit', payload_nolimit=payload, services=services_list)
-    else:
-        new_message = Message(event_type=event_type, payload=payload, services=services_list)
+        return {'event_type': event_type, 'payload': 'nolimit', 'payload_nolimit': payload, 'services': services_list}
+    return {'event_type': event_type, 'payload': payload, 'services': services_list}
+
 
+@transactional_session
+def add_message(event_type, payload, session=None):
+    """
+    Add a message to be submitted asynchronously to a message broker.
+
+    In the case of nolimit, a placeholder string is written to the NOT NULL payload column.
+
+    :param event_type: The type of the event as a string, e.g., NEW_DID.
+    :param payload: The message payload. Will be persisted as JSON.
+    :param session: The database session to use.
+    """
+    new_message = Message(**__message_values(event_type, payload, __get_services_list()))
     new_message.save(session=session, flush=False)
 
 
+@transactional_session
+def add_messages(messages, session=None):
+    """
+    Add a list of messages to be submitted asynchronously to a message broker with a single bulk insertion.
+
+    :param messages: A list of (event_type, payload) tuples.
+    :param session: The database session to use.
+    """
+    if not messages:
+        return
+    services_list = __get_services_list()
+    session.bulk_insert_mappings(Message, [__message_values(event_type, payload, services_list) for event_type, payload in messages])
+
+
 @transactional_session
 def retrieve_messages(bulk=1000, thread=None, total_threads=None, event_type=None,
                       lock=False, session=None):
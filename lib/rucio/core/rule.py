@@ -3258,6 +3258,35 @@ def archive_localgroupdisk_datasets(scope, name, session=None, logger=logging.lo
             logger(logging.DEBUG, 'Re-Scoped %s:%s', scope, name)
 
 
+@policy_filter
+@transactional_session
+def archive_localgroupdisk_datasets_bulk(dids, session=None, logger=logging.log):
+    """
+    ATLAS policy to archive the datasets which have a replica on LOCALGROUPDISK
+
+    :param dids:     List of dataset dictionaries {'scope': ..., 'name': ...}.
+    :param session:  The database session in use.
+    :param logger:   Optional decorated logger that can be passed from the calling daemons or servers.
+    """
+
+    # Only the datasets with a lock on a LOCALGROUPDISK need to be archived.
+    # LIKE is case-insensitive on MySQL and SQLite, while archive_localgroupdisk_datasets
+    # checks the RSE name case-sensitively. RSE names are upper case by schema, so both
+    # select the same RSEs.
+    localgroupdisk_datasets = set()
+    did_keys = [(did['scope'], did['name']) for did in dids]
+    for chunk in chunks(did_keys, rucio.core.did.KEY_CHUNK_SIZE):
+        query = session.query(models.DatasetLock.scope, models.DatasetLock.name).\
+            join(models.RSE, models.RSE.id == models.DatasetLock.rse_id).\
+            filter(models.RSE.rse.like('%LOCALGROUPDISK%')).\
+            filter(tuple_(models.DatasetLock.scope, models.DatasetLock.name).in_(chunk))
+        localgroupdisk_datasets.update(query)
+
+    for did in dids:
+        if (did['scope'], did['name']) in localgroupdisk_datasets:
+            archive_localgroupdisk_datasets(scope=did['scope'], name=did['name'], session=session, logger=logger)
+
+
 @policy_filter
 @read_session
 def get_scratch_policy(account, rses, lifetime, session=None):
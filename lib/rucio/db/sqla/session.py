@@ -29,6 +29,7 @@ import os
 import sys
 
 from functools import wraps
+from hashlib import md5
 from inspect import isgeneratorfunction
 from retrying import retry
 from threading import Lock
@@ -74,6 +75,18 @@ def _fk_pragma_on_connect(dbapi_con, con_record):
         pass
 
 
+def _sqlite_md5_mod(value, modulo):
+    """ Hashes a value with md5 and returns it modulo the given number, as used for worker sharding """
+    if value is None or not modulo:
+        return None
+    return int(md5(value.encode()).hexdigest(), 16) % modulo
+
+
+def _sqlite_functions_on_connect(dbapi_con, con_record):
+    """ Registers the user-defined functions used in queries on SQLite connections """
+    dbapi_con.create_function('md5_mod', 2, _sqlite_md5_mod)
+
+
 def mysql_ping_listener(dbapi_conn, connection_rec, connection_proxy):
     """
     Ensures that MySQL connections checked out of the
@@ -182,6 +195,11 @@ def get_engine(echo=True):
         if 'mysql' in sql_connection:
             conv = mysql_convert_decimal_to_float(pymysql=sql_connection.startswith('mysql+pymysql'))
             params['connect_args'] = {'conv': conv}
+        elif 'postgresql' in sql_connection:
+            # Use psycopg2.extras.execute_values for executemany INSERTs instead of one statement per row
+            params['executemany_mode'] = 'values'
+            params['executemany_values_page_size'] = 1000
+            config_params += [('executemany_mode', str), ('executemany_values_page_size', int)]
         for param, param_type in config_params:
             try:
                 params[param] = param_type(config_get(DATABASE_SECTION, param))
@@ -194,6 +212,7 @@ def get_engine(echo=True):
             event.listen(_ENGINE, 'connect', psql_convert_decimal_to_float)
         elif 'sqlite' in sql_connection:
             event.listen(_ENGINE, 'connect', _fk_pragma_on_connect)
+            event.listen(_ENGINE, 'connect', _sqlite_functions_on_connect)
         elif 'oracle' in sql_connection:
             event.listen(_ENGINE, 'connect', my_on_connect)
     assert _ENGINE
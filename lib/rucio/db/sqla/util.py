@@ -37,9 +37,8 @@ from alembic import command
 from alembic.config import Config
 from sqlalchemy import func
 from sqlalchemy.engine import reflection
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy.schema import CreateSchema, MetaData, Table, DropTable, ForeignKeyConstraint, DropConstraint
-from sqlalchemy.sql.expression import select, text
+from sqlalchemy.sql.expression import select, text, tuple_
 
 from rucio import alembicrevision
 from rucio.common.config import config_get
@@ -53,6 +52,13 @@ if TYPE_CHECKING:
     from typing import Optional  # noqa: F401
     from sqlalchemy.orm import Session  # noqa: F401
 
+# Queries for the UTC time on the db per dialect, with the format to parse it if it is returned as a string
+DB_TIME_QUERIES = {'oracle': (select([text("sys_extract_utc(systimestamp)")]), None),
+                   'mysql': (select([text("utc_timestamp()")]), None),
+                   'sqlite': (select([text("datetime('now', 'utc')")]), '%Y-%m-%d  %H:%M:%S')}
+DEFAULT_DB_TIME_QUERY = (select([func.current_date()]), None)
+COMPILED_CACHE = {}
+
 
 def build_database(echo=True):
     """ Applies the schema to the database. Run this command once to build the database. """
@@ -103,6 +109,18 @@ def drop_everything(echo=True):
 
     inspector = reflection.Inspector.from_engine(engine)
 
+    # Postgresql drops the constraints together with the tables,
+    # so everything can go in one statement without reflecting the foreign keys.
+    # A failure aborts the whole transaction, so it is raised instead of skipped.
+    if engine.dialect.name == 'postgresql':
+        table_names = inspector.get_table_names()
+        if table_names:
+            stmt = 'DROP TABLE IF EXISTS %s CASCADE' % ', '.join(engine.dialect.identifier_preparer.quote(name) for name in table_names)
+            print(stmt + ';')
+            conn.execute(text(stmt))
+        trans.commit()
+        return
+
     # gather all data first before dropping anything.
     # some DBs lock after things have been dropped in
     # a transaction.
@@ -195,39 +213,32 @@ def create_root_account(create_counters=True):
 
     account = models.Account(account=InternalAccount(access, 'def'), account_type=AccountType.SERVICE, status=AccountStatus.ACTIVE)
 
-    salt = urandom(255)
+    salt = urandom(32)
     salted_password = salt + up_pwd.encode()
     hashed_password = sha256(salted_password).hexdigest()
-    identity1 = models.Identity(identity=up_id, identity_type=IdentityType.USERPASS, password=hashed_password, salt=salt, email=up_email)
-    iaa1 = models.IdentityAccountAssociation(identity=identity1.identity, identity_type=identity1.identity_type, account=account.account, is_default=True)
-
-    # X509 authentication
-    identity2 = models.Identity(identity=x509_id, identity_type=IdentityType.X509, email=x509_email)
-    iaa2 = models.IdentityAccountAssociation(identity=identity2.identity, identity_type=identity2.identity_type, account=account.account, is_default=True)
 
-    # GSS authentication
-    identity3 = models.Identity(identity=gss_id, identity_type=IdentityType.GSS, email=gss_email)
-    iaa3 = models.IdentityAccountAssociation(identity=identity3.identity, identity_type=identity3.identity_type, account=account.account, is_default=True)
-
-    # SSH authentication
-    identity4 = models.Identity(identity=ssh_id, identity_type=IdentityType.SSH, email=ssh_email)
-    iaa4 = models.IdentityAccountAssociation(identity=identity4.identity, identity_type=identity4.identity_type, account=account.account, is_default=True)
+    # Userpass, X509, GSS and SSH authentication
+    identities = [models.Identity(identity=identity, identity_type=identity_type, email=email, **extra)
+                  for identity, identity_type, email, extra in ((up_id, IdentityType.USERPASS, up_email, {'password': hashed_password, 'salt': salt}),
+                                                                (x509_id, IdentityType.X509, x509_email, {}),
+                                                                (gss_id, IdentityType.GSS, gss_email, {}),
+                                                                (ssh_id, IdentityType.SSH, ssh_email, {}))]
+
+    # Apply in a single transaction
+    # Identities may already be in the DB when running multi-VO conversion
+    existing = set(s.query(models.Identity.identity, models.Identity.identity_type).
+                   filter(tuple_(models.Identity.identity, models.Identity.identity_type).in_([(identity.identity, identity.identity_type) for identity in identities])))
+    s.add_all([identity for identity in identities if (identity.identity, identity.identity_type) not in existing])
+    s.add(account)
+    s.flush()
 
     # Account counters
     if create_counters:
         create_counters_for_new_account(account=account.account, session=s)
 
-    # Apply
-    for identity in [identity1, identity2, identity3, identity4]:
-        try:
-            s.add(identity)
-            s.commit()
-        except IntegrityError:
-            # Identities may already be in the DB when running multi-VO conversion
-            s.rollback()
-    s.add(account)
-    s.commit()
-    s.add_all([iaa1, iaa2, iaa3, iaa4])
+    s.execute(models.IdentityAccountAssociation.__table__.insert(),
+              [{'identity': identity.identity, 'identity_type': identity.identity_type, 'account': account.account, 'is_default': True}
+               for identity in identities])
     s.commit()
 
 
@@ -235,18 +246,10 @@ def get_db_time():
     """ Gives the utc time on the db. """
     s = get_session()
     try:
-        storage_date_format = None
-        if s.bind.dialect.name == 'oracle':
-            query = select([text("sys_extract_utc(systimestamp)")])
-        elif s.bind.dialect.name == 'mysql':
-            query = select([text("utc_timestamp()")])
-        elif s.bind.dialect.name == 'sqlite':
-            query = select([text("datetime('now', 'utc')")])
-            storage_date_format = '%Y-%m-%d  %H:%M:%S'
-        else:
-            query = select([func.current_date()])
-
-        for now, in s.execute(query):
+        query, storage_date_format = DB_TIME_QUERIES.get(s.bind.dialect.name, DEFAULT_DB_TIME_QUERY)
+
+        # The statements never change, so their compiled form is cached per dialect
+        for now, in s.connection().execution_options(compiled_cache=COMPILED_CACHE).execute(query):
             if storage_date_format:
                 return datetime.strptime(now, storage_date_format)
             return now
@@ -262,7 +265,8 @@ def get_count(q):
     Some limits, see a more thorough version above
     """
 
-    count_q = q.statement.with_only_columns([func.count()]).order_by(None)
+    # Count over the query as a subquery, so that grouped, distinct or limited queries are counted correctly
+    count_q = select([func.count()]).select_from(q.statement.order_by(None).alias())
     count = q.session.execute(count_q).scalar()
     return count
 
@@ -279,8 +283,8 @@ def is_old_db():
         return False
 
     s = get_session()
-    query = s.query(models.AlembicVersion.version_num)
-    return query.count() != 0 and str(query.first()[0]) != alembicrevision.ALEMBIC_REVISION
+    version = s.query(models.AlembicVersion.version_num).first()
+    return version is not None and str(version[0]) != alembicrevision.ALEMBIC_REVISION
 
 
 def json_implemented(session=None):
@@ -294,11 +298,15 @@ def json_implemented(session=None):
     if session is None:
         session = get_session()
 
-    if session.bind.dialect.name == 'oracle':
-        oracle_version = int(session.connection().connection.version.split('.')[0])
+    dialect = session.bind.dialect
+    if dialect.name == 'oracle':
+        # The server version is read by the dialect on the first connection of the engine
+        if dialect.server_version_info is None:
+            session.connection()
+        oracle_version = dialect.server_version_info[0]
         if oracle_version < 12:
             return False
-    elif session.bind.dialect.name == 'sqlite':
+    elif dialect.name == 'sqlite':
         return False
 
     return True
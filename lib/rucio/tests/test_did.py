@@ -32,10 +32,13 @@
 
 from __future__ import print_function
 
+import json
 import unittest
 from datetime import datetime, timedelta
+from unittest import mock
 
 import pytest
+from sqlalchemy import and_
 
 from rucio.api import did
 from rucio.api import scope
@@ -52,13 +55,18 @@ from rucio.common.exception import (DataIdentifierNotFound, DataIdentifierAlread
                                     UnsupportedStatus, ScopeNotFound, FileAlreadyExists, FileConsistencyMismatch)
 from rucio.common.types import InternalAccount, InternalScope
 from rucio.common.utils import generate_uuid
+from rucio.core.account import get_account
 from rucio.core.account_limit import set_local_account_limit
 from rucio.core.did import (list_dids, add_did, delete_dids, get_did_atime, touch_dids, attach_dids, detach_dids,
                             get_metadata, set_metadata, get_did, get_did_access_cnt, add_did_to_followed,
-                            get_users_following_did, remove_did_from_followed)
+                            get_users_following_did, remove_did_from_followed, get_did_access_info, list_all_parent_dids,
+                            list_files, list_content, set_status, insert_deleted_dids, resurrect,
+                            create_did_sample, trigger_event, create_reports, get_dataset_by_guid)
 from rucio.core.replica import add_replica
 from rucio.core.rse import get_rse_id
+from rucio.db.sqla import models
 from rucio.db.sqla.constants import DIDType
+from rucio.db.sqla.session import read_session, transactional_session
 from rucio.tests.common import rse_name_generator, scope_name_generator
 
 
@@ -106,6 +114,8 @@ class TestDIDCore(unittest.TestCase):
         touch_dids(dids=[{'scope': tmp_scope, 'name': tmp_dsn1, 'type': DIDType.DATASET, 'accessed_at': now}])
         assert now == get_did_atime(scope=tmp_scope, name=tmp_dsn1)
         assert get_did_atime(scope=tmp_scope, name=tmp_dsn2) is None
+        assert get_did_access_info(scope=tmp_scope, name=tmp_dsn1) == (now, 1)
+        assert get_did_access_info(scope=tmp_scope, name=tmp_dsn2) == (None, None)
 
     @pytest.mark.dirty
     def test_touch_dids_access_cnt(self):
@@ -256,6 +266,252 @@ class TestDIDCore(unittest.TestCase):
         assert rows == 0
 
 
+    @pytest.mark.dirty
+    @pytest.mark.noparallel(reason='uses pre-defined RSE')
+    def test_list_all_parent_dids(self):
+        """ DATA IDENTIFIERS (CORE): List all parents of a did reachable over several paths """
+        tmp_scope = InternalScope('mock', **self.vo)
+        root = InternalAccount('root', **self.vo)
+        rse_id = get_rse_id(rse='MOCK', **self.vo)
+        file_name = 'file_%s' % generate_uuid()
+        dsn1, dsn2 = 'dsn_%s' % generate_uuid(), 'dsn_%s' % generate_uuid()
+        cnt1, cnt2 = 'cnt_%s' % generate_uuid(), 'cnt_%s' % generate_uuid()
+
+        for dsn in (dsn1, dsn2):
+            add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+        for cnt in (cnt1, cnt2):
+            add_did(scope=tmp_scope, name=cnt, type=DIDType.CONTAINER, account=root)
+
+        # The file is in two datasets of the same container, so cnt1 and cnt2 are reachable over two paths
+        attach_dids(scope=tmp_scope, name=dsn1, rse_id=rse_id, dids=[{'scope': tmp_scope, 'name': file_name, 'bytes': 1, 'adler32': '0cc737eb'}], account=root)
+        attach_dids(scope=tmp_scope, name=dsn2, dids=[{'scope': tmp_scope, 'name': file_name}], account=root)
+        attach_dids(scope=tmp_scope, name=cnt1, dids=[{'scope': tmp_scope, 'name': dsn1}, {'scope': tmp_scope, 'name': dsn2}], account=root)
+        attach_dids(scope=tmp_scope, name=cnt2, dids=[{'scope': tmp_scope, 'name': cnt1}], account=root)
+
+        # Walk up with the recursive query and with the fallback of databases without recursive queries
+        for supports_recursive_cte in (True, False):
+            with mock.patch('rucio.core.did._supports_recursive_cte', return_value=supports_recursive_cte):
+                parents = [parent['name'] for parent in list_all_parent_dids(scope=tmp_scope, name=file_name)]
+            assert sorted(parents) == sorted([dsn1, dsn2, cnt1, cnt2])
+
+    @pytest.mark.dirty
+    @pytest.mark.noparallel(reason='uses pre-defined RSE')
+    def test_list_files_nested_long(self):
+        """ DATA IDENTIFIERS (CORE): List the files of nested containers with their metadata """
+        tmp_scope = InternalScope('mock', **self.vo)
+        root = InternalAccount('root', **self.vo)
+        rse_id = get_rse_id(rse='MOCK', **self.vo)
+        dsn = 'dsn_%s' % generate_uuid()
+        cnt1, cnt2 = 'cnt_%s' % generate_uuid(), 'cnt_%s' % generate_uuid()
+
+        add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+        for cnt in (cnt1, cnt2):
+            add_did(scope=tmp_scope, name=cnt, type=DIDType.CONTAINER, account=root)
+
+        files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(), 'bytes': i + 1,
+                  'adler32': '0cc737eb', 'meta': {'events': 10 * (i + 1)}} for i in range(3)]
+        attach_dids(scope=tmp_scope, name=dsn, rse_id=rse_id, dids=files, account=root)
+        attach_dids(scope=tmp_scope, name=cnt2, dids=[{'scope': tmp_scope, 'name': dsn}], account=root)
+        attach_dids(scope=tmp_scope, name=cnt1, dids=[{'scope': tmp_scope, 'name': cnt2}], account=root)
+
+        expected = sorted((file['name'], file['bytes'], file['meta']['events']) for file in files)
+        # Walk down with the recursive query and with the iteration of databases without recursive queries
+        for supports_recursive_cte in (True, False):
+            with mock.patch('rucio.core.did._supports_recursive_cte', return_value=supports_recursive_cte):
+                listed = list(list_files(scope=tmp_scope, name=cnt1, long=True))
+            assert sorted((file['name'], file['bytes'], file['events']) for file in listed) == expected
+            assert all('lumiblocknr' in file for file in listed)
+
+    @pytest.mark.dirty
+    @pytest.mark.noparallel(reason='uses pre-defined RSE')
+    def test_detach_several_dids(self):
+        """ DATA IDENTIFIERS (CORE): Detach several dids in one call """
+        tmp_scope = InternalScope('mock', **self.vo)
+        root = InternalAccount('root', **self.vo)
+        dsn = 'dsn_%s' % generate_uuid()
+        add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+
+        files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(),
+                  'bytes': 1, 'adler32': '0cc737eb'} for i in range(3)]
+        attach_dids(scope=tmp_scope, name=dsn, rse_id=get_rse_id(rse='MOCK', **self.vo), dids=files, account=root)
+
+        @read_session
+        def __get_detached_names(session=None):
+            query = session.query(models.DataIdentifierAssociationHistory.child_name).filter_by(scope=tmp_scope, name=dsn)
+            return sorted(child_name for child_name, in query)
+
+        # A missing child fails the whole detach
+        with pytest.raises(DataIdentifierNotFound):
+            detach_dids(scope=tmp_scope, name=dsn, dids=[files[0], {'scope': tmp_scope, 'name': 'file_%s' % generate_uuid()}])
+        assert len(list(list_content(scope=tmp_scope, name=dsn))) == 3
+        assert __get_detached_names() == []
+
+        detach_dids(scope=tmp_scope, name=dsn, dids=files[:2])
+        assert [content['name'] for content in list_content(scope=tmp_scope, name=dsn)] == [files[2]['name']]
+        assert __get_detached_names() == sorted(file['name'] for file in files[:2])
+
+    @pytest.mark.dirty
+    @pytest.mark.noparallel(reason='uses pre-defined RSE')
+    def test_detach_dids_from_closed_dataset(self):
+        """ DATA IDENTIFIERS (CORE): Detach dids from a closed dataset and decrement its length, bytes and events """
+        tmp_scope = InternalScope('mock', **self.vo)
+        root = InternalAccount('root', **self.vo)
+        dsn = 'dsn_%s' % generate_uuid()
+        add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+
+        files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(), 'bytes': 10 * (i + 1),
+                  'adler32': '0cc737eb', 'meta': {'events': i + 1}} for i in range(3)]
+        attach_dids(scope=tmp_scope, name=dsn, rse_id=get_rse_id(rse='MOCK', **self.vo), dids=files, account=root)
+
+        @transactional_session
+        def __unset_content_counters(child_name, session=None):
+            session.query(models.DataIdentifierAssociation).\
+                filter_by(scope=tmp_scope, name=dsn, child_scope=tmp_scope, child_name=child_name).\
+                update({'bytes': None, 'events': None}, synchronize_session=False)
+
+        # The last file has no known bytes and events in the dataset
+        __unset_content_counters(files[2]['name'])
+        set_status(scope=tmp_scope, name=dsn, open=False)
+        meta = get_metadata(scope=tmp_scope, name=dsn)
+        assert (meta['length'], meta['bytes'], meta['events']) == (3, 30, 3)
+
+        detach_dids(scope=tmp_scope, name=dsn, dids=[files[0], files[2]])
+        meta = get_metadata(scope=tmp_scope, name=dsn)
+        assert (meta['length'], meta['bytes'], meta['events']) == (1, 20, 2)
+
+    @pytest.mark.dirty
+    def test_resurrect_dids(self):
+        """ DATA IDENTIFIERS (CORE): Resurrect several deleted dids """
+        tmp_scope = InternalScope('mock', **self.vo)
+        root = InternalAccount('root', **self.vo)
+        dsns = ['dsn_%s' % generate_uuid() for i in range(2)]
+        for dsn in dsns:
+            add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+            set_metadata(scope=tmp_scope, name=dsn, key='project', value='data13_hip')
+
+        # Archive the dids before deleting them, as the deletion of replicas does
+        insert_deleted_dids(did_clause=[and_(models.DataIdentifier.scope == tmp_scope, models.DataIdentifier.name == dsn) for dsn in dsns])
+        delete_dids(dids=[{'scope': tmp_scope, 'name': dsn, 'did_type': DIDType.DATASET, 'purge_replicas': True} for dsn in dsns], account=root)
+        for dsn in dsns:
+            with pytest.raises(DataIdentifierNotFound):
+                get_did(scope=tmp_scope, name=dsn)
+
+        resurrect(dids=[{'scope': tmp_scope, 'name': dsn} for dsn in dsns])
+        for dsn in dsns:
+            assert get_did(scope=tmp_scope, name=dsn)['type'] == DIDType.DATASET
+            assert get_metadata(scope=tmp_scope, name=dsn)['project'] == 'data13_hip'
+
+    @pytest.mark.dirty
+    def test_resurrect_unknown_did(self):
+        """ DATA IDENTIFIERS (CORE): Resurrect nothing if one of the dids is unknown """
+        tmp_scope = InternalScope('mock', **self.vo)
+        root = InternalAccount('root', **self.vo)
+        dsn = 'dsn_%s' % generate_uuid()
+        add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+        insert_deleted_dids(did_clause=[and_(models.DataIdentifier.scope == tmp_scope, models.DataIdentifier.name == dsn)])
+        delete_dids(dids=[{'scope': tmp_scope, 'name': dsn, 'did_type': DIDType.DATASET, 'purge_replicas': True}], account=root)
+
+        with pytest.raises(DataIdentifierNotFound):
+            resurrect(dids=[{'scope': tmp_scope, 'name': dsn}, {'scope': tmp_scope, 'name': 'dsn_%s' % generate_uuid()}])
+        with pytest.raises(DataIdentifierNotFound):
+            get_did(scope=tmp_scope, name=dsn)
+
+        # The deleted did is still there to be resurrected on its own
+        resurrect(dids=[{'scope': tmp_scope, 'name': dsn}])
+        assert get_did(scope=tmp_scope, name=dsn)['type'] == DIDType.DATASET
+
+    @pytest.mark.dirty
+    @pytest.mark.noparallel(reason='uses pre-defined RSE')
+    def test_create_did_sample(self):
+        """ DATA IDENTIFIERS (CORE): Create a sample of the files of a dataset """
+        tmp_scope = InternalScope('mock', **self.vo)
+        root = InternalAccount('root', **self.vo)
+        input_dsn, output_dsn = 'dsn_%s' % generate_uuid(), 'dsn_%s' % generate_uuid()
+        add_did(scope=tmp_scope, name=input_dsn, type=DIDType.DATASET, account=root)
+
+        files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(),
+                  'bytes': 1, 'adler32': '0cc737eb'} for i in range(10)]
+        attach_dids(scope=tmp_scope, name=input_dsn, rse_id=get_rse_id(rse='MOCK', **self.vo), dids=files, account=root)
+
+        create_did_sample(input_scope=tmp_scope, input_name=input_dsn, output_scope=tmp_scope, output_name=output_dsn, account=root, nbfiles=4)
+        sample = [content['name'] for content in list_content(scope=tmp_scope, name=output_dsn)]
+        assert len(sample) == len(set(sample)) == 4
+        assert set(sample) <= set(file['name'] for file in files)
+
+    @pytest.mark.dirty
+    def test_trigger_event(self):
+        """ DATA IDENTIFIERS (CORE): Record an event for every follower of a did """
+        tmp_scope = InternalScope('mock', **self.vo)
+        root = InternalAccount('root', **self.vo)
+        jdoe = InternalAccount('jdoe', **self.vo)
+        dsn = 'dsn_%s' % generate_uuid()
+        add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+        for account in (root, jdoe):
+            add_did_to_followed(scope=tmp_scope, name=dsn, account=account)
+
+        trigger_event(scope=tmp_scope, name=dsn, event_type='CLOSE', payload='closed by test')
+
+        @read_session
+        def __get_events(session=None):
+            return session.query(models.FollowEvents).filter_by(scope=tmp_scope, name=dsn).all()
+
+        events = __get_events()
+        assert sorted(event.account.external for event in events) == sorted([root.external, jdoe.external])
+        for event in events:
+            assert event.did_type == DIDType.DATASET
+            assert (event.event_type, event.payload) == ('CLOSE', 'closed by test')
+            assert event.created_at is not None
+
+    @pytest.mark.dirty
+    def test_create_reports(self):
+        """ DATA IDENTIFIERS (CORE): Create one report per account following dids """
+        tmp_scope = InternalScope('mock', **self.vo)
+        root = InternalAccount('root', **self.vo)
+        jdoe = InternalAccount('jdoe', **self.vo)
+        dsn = 'dsn_%s' % generate_uuid()
+        add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+        for account in (root, jdoe):
+            add_did_to_followed(scope=tmp_scope, name=dsn, account=account)
+        trigger_event(scope=tmp_scope, name=dsn, event_type='CLOSE', payload='closed by test')
+
+        create_reports(total_workers=1, worker_number=0)
+
+        @read_session
+        def __get_reports_and_events(session=None):
+            query = session.query(models.Message.payload).filter(models.Message.event_type == 'email',
+                                                                 models.Message.payload.like('%%%s%%' % dsn))
+            reports = [json.loads(payload) for payload, in query]
+            return reports, session.query(models.FollowEvents).filter_by(scope=tmp_scope, name=dsn).count()
+
+        reports, nb_events = __get_reports_and_events()
+        # The email of an account can be unset, so the addresses are sorted as strings
+        assert sorted((report['to'] for report in reports), key=str) == sorted((get_account(account)['email'] for account in (root, jdoe)), key=str)
+        assert nb_events == 0
+
+    @pytest.mark.dirty
+    @pytest.mark.noparallel(reason='uses pre-defined RSE')
+    def test_get_dataset_by_guid(self):
+        """ DATA IDENTIFIERS (CORE): Get the parent datasets of a file by GUID """
+        tmp_scope = InternalScope('mock', **self.vo)
+        root = InternalAccount('root', **self.vo)
+        rse_id = get_rse_id(rse='MOCK', **self.vo)
+        dsn = 'dsn_%s' % generate_uuid()
+        add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+
+        guid = generate_uuid()
+        files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(),
+                  'bytes': 1, 'adler32': '0cc737eb', 'meta': {'guid': guid}}]
+        attach_dids(scope=tmp_scope, name=dsn, rse_id=rse_id, dids=files, account=root)
+        assert list(get_dataset_by_guid(guid=guid)) == [{'scope': tmp_scope, 'name': dsn}]
+
+        # A file without parent datasets is not an error
+        orphan_guid = generate_uuid()
+        add_replica(rse_id=rse_id, scope=tmp_scope, name='file_%s' % generate_uuid(), bytes=1, account=root, meta={'guid': orphan_guid})
+        assert list(get_dataset_by_guid(guid=orphan_guid)) == []
+
+        with pytest.raises(DataIdentifierNotFound):
+            list(get_dataset_by_guid(guid=generate_uuid()))
+
 class TestDIDApi(unittest.TestCase):
     def setUp(self):
         if config_get_bool('common', 'multi_vo', raise_exception=False, default=False):
@@ -24,7 +24,7 @@
 import pytest
 
 from rucio.common.exception import InvalidObject
-from rucio.core.message import add_message, retrieve_messages, delete_messages, truncate_messages
+from rucio.core.message import add_message, add_messages, retrieve_messages, delete_messages, truncate_messages
 
 
 @pytest.mark.noparallel(reason='fails when run in parallel')
@@ -69,3 +69,16 @@ class TestMessagesCore:
         delete_messages(to_delete)
 
         assert retrieve_messages() == []
+
+    def test_add_messages(self):
+        """ MESSAGE (CORE): Test bulk insertion of messages """
+
+        truncate_messages()
+        add_messages([('TEST', {'number': i, 'payload': 'x' * (4000 * (i % 2))}) for i in range(10)])
+
+        messages = retrieve_messages(20)
+        assert len(messages) == 10
+        assert sorted(message['payload']['number'] for message in messages) == list(range(10))
+
+        with pytest.raises(InvalidObject):
+            add_messages([('TEST', {'type': int})])
@@ -25,9 +25,11 @@
 
 from __future__ import print_function
 
+import logging
 import os
 import shutil
 import tempfile
+import threading
 import unittest
 from uuid import uuid4 as uuid
 
@@ -39,23 +41,33 @@ from rucio.rse import rsemanager
 from rucio.tests.common import skip_rse_tests_with_accounts, load_test_conf_file
 from rucio.tests.rsemgr_api_test import MgrTestCases
 
+LOGGER = logging.getLogger(__name__)
+
 
 @pytest.mark.noparallel(reason='creates and removes a test directory with a fixed name')
 @skip_rse_tests_with_accounts
 class TestRseXROOTD(unittest.TestCase):
     tmpdir = None
     user = None
+    rse_info = None
 
     @classmethod
     def get_rse_info(cls):
         """
         Detects if containerized rses for xrootd are available in the testing environment.
+        The detection runs the rucio client once, later calls return the same result.
         :return: A tuple (rse, prefix, hostname, port).
         """
+        if cls.rse_info is None:
+            cls.rse_info = cls._detect_rse_info()
+        return cls.rse_info
+
+    @staticmethod
+    def _detect_rse_info():
         cmd = "rucio list-rses --expression 'test_container_xrd=True'"
-        print(cmd)
+        LOGGER.debug('%s', cmd)
         exitcode, out, err = execute(cmd)
-        print(out, err)
+        LOGGER.debug('%s %s', out, err)
         rses = out.split()
 
         data = load_test_conf_file('rse_repository.json')
@@ -82,36 +94,42 @@ class TestRseXROOTD(unittest.TestCase):
         try:
             os.mkdir(prefix)
         except Exception as e:
-            print(e)
+            LOGGER.debug('%s', e)
 
         # Creating local files
         cls.tmpdir = tempfile.mkdtemp()
         cls.user = uuid()
 
-        with open("%s/data.raw" % cls.tmpdir, "wb") as out:
-            out.seek((1024 * 1024) - 1)  # 1 MB
-            out.write(b'\0')
-        for f in MgrTestCases.files_local:
-            shutil.copy('%s/data.raw' % cls.tmpdir, '%s/%s' % (cls.tmpdir, f))
+        # The files only contain zeros, so they are created sparse instead of being copied from data.raw
+        for f in ['data.raw'] + MgrTestCases.files_local + MgrTestCases.files_local_and_remote:
+            with open('%s/%s' % (cls.tmpdir, f), 'wb') as out:
+                out.truncate(1024 * 1024)  # 1 MB
+
+        cls.static_file = 'xroot://%s:%d/%s/data.raw' % (hostname, port, prefix)
+
+        # The RSE settings and credentials are looked up once and shared by all the tests
+        cls.mtc = MgrTestCases(cls.tmpdir, rse_id, cls.user, cls.static_file)
 
-        protocol = rsemanager.create_protocol(rsemanager.get_rse_info(rse_id), 'write')
-        protocol.connect()
+        # The protocol is only used to build the PFNs, which does not need a connection to the server
+        protocol = rsemanager.create_protocol(cls.mtc.rse_settings, 'write')
 
         os.system('dd if=/dev/urandom of=%s/data.raw bs=1024 count=1024' % prefix)
-        cls.static_file = 'xroot://%s:%d/%s/data.raw' % (hostname, port, prefix)
-        cmd = 'xrdcp %s/data.raw %s' % (prefix, cls.static_file)
-        execute(cmd)
+        cmds = ['xrdcp %s/data.raw %s' % (prefix, cls.static_file)]
 
         for f in MgrTestCases.files_remote:
             path = protocol.path2pfn(prefix + protocol._get_path('user.%s' % cls.user, f))
-            cmd = 'xrdcp %s/data.raw %s' % (prefix, path)
-            execute(cmd)
+            cmds.append('xrdcp %s/data.raw %s' % (prefix, path))
 
         for f in MgrTestCases.files_local_and_remote:
-            shutil.copy('%s/data.raw' % cls.tmpdir, '%s/%s' % (cls.tmpdir, f))
             path = protocol.path2pfn(prefix + protocol._get_path('user.%s' % cls.user, f))
-            cmd = 'xrdcp %s/%s %s' % (cls.tmpdir, f, path)
-            execute(cmd)
+            cmds.append('xrdcp %s/%s %s' % (cls.tmpdir, f, path))
+
+        # The uploads only read local files and are independent of each other, so they run concurrently
+        uploads = [threading.Thread(target=execute, kwargs={'cmd': cmd}) for cmd in cmds]
+        for upload in uploads:
+            upload.start()
+        for upload in uploads:
+            upload.join()
 
     @classmethod
     def tearDownClass(cls):
@@ -139,12 +157,6 @@ class TestRseXROOTD(unittest.TestCase):
             clean_cmd = 'xrdfs %s rmdir %s' % (hostname, directory)
             execute(clean_cmd)
 
-    def setUp(self):
-        """XROOTD (RSE/PROTOCOLS): Creating Mgr-instance """
-        self.tmpdir = TestRseXROOTD.tmpdir
-        self.rse_id, self.prefix, self.hostname, self.port = TestRseXROOTD.get_rse_info()
-        self.mtc = MgrTestCases(self.tmpdir, self.rse_id, TestRseXROOTD.user, TestRseXROOTD.static_file)
-
     # Mgr-Tests: PUT
     def test_put_mgr_ok_multi(self):
         """XROOTD (RSE/PROTOCOLS): Put multiple files to storage providing LFNs and PFNs (Success)"""
@@ -32,15 +32,17 @@ from logging import getLogger
 import pytest
 
 from rucio.common.config import config_get, config_get_bool
+from rucio.common.exception import DataIdentifierNotFound
 from rucio.common.policy import get_policy
 from rucio.common.types import InternalAccount, InternalScope
 from rucio.common.utils import generate_uuid
 from rucio.core.account_limit import set_local_account_limit
-from rucio.core.did import add_dids, attach_dids, list_expired_dids, get_did, set_metadata
+from rucio.core.did import add_dids, attach_dids, delete_dids, list_expired_dids, get_did, set_metadata
 from rucio.core.replica import get_replica
 from rucio.core.rse import get_rse_id, add_rse
 from rucio.core.rule import add_rules, list_rules
 from rucio.daemons.undertaker.undertaker import undertaker
+from rucio.db.sqla.constants import DIDType
 from rucio.db.sqla.util import json_implemented
 from rucio.tests.common import rse_name_generator
 
@@ -171,3 +173,40 @@ class TestUndertaker(unittest.TestCase):
         for dsn in dsns2:
             assert(get_did(scope=InternalScope('archive', **self.vo), name=dsn['name'])['name'] == dsn['name'])
             assert(len([x for x in list_rules(filters={'scope': InternalScope('archive', **self.vo), 'name': dsn['name']})]) == 1)
+
+    def test_atlas_archival_policy_only_localgroupdisk(self):
+        """ UNDERTAKER (CORE): Test that the atlas archival policy only archives datasets locked on a LOCALGROUPDISK. """
+        if get_policy() != 'atlas':
+            LOG.info("Skipping atlas-specific test")
+            return
+
+        tmp_scope = InternalScope('mock', **self.vo)
+        jdoe = InternalAccount('jdoe', **self.vo)
+        root = InternalAccount('root', **self.vo)
+        archive = InternalScope('archive', **self.vo)
+
+        localgroupdisk = 'LOCALGROUPDISK_%s' % rse_name_generator()
+        localgroupdisk_id = add_rse(localgroupdisk, **self.vo)
+        other_rse = 'MOCK_%s' % rse_name_generator()
+        other_rse_id = add_rse(other_rse, **self.vo)
+
+        dsns = []
+        for rse, rse_id in ((localgroupdisk, localgroupdisk_id), (other_rse, other_rse_id)):
+            set_local_account_limit(jdoe, rse_id, -1)
+            dsn = {'name': 'dsn_%s' % generate_uuid(),
+                   'scope': tmp_scope,
+                   'type': 'DATASET',
+                   'rules': [{'account': jdoe, 'copies': 1,
+                              'rse_expression': rse,
+                              'grouping': 'DATASET'}]}
+            add_dids(dids=[dsn], account=root)
+            files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(), 'bytes': 1,
+                      'adler32': '0cc737eb', 'meta': {'events': 10}} for i in range(2)]
+            attach_dids(scope=tmp_scope, name=dsn['name'], rse_id=rse_id, dids=files, account=root)
+            dsns.append(dsn)
+
+        delete_dids(dids=[{'scope': dsn['scope'], 'name': dsn['name'], 'did_type': DIDType.DATASET, 'purge_replicas': True} for dsn in dsns], account=root)
+
+        assert get_did(scope=archive, name=dsns[0]['name'])['name'] == dsns[0]['name']
+        with pytest.raises(DataIdentifierNotFound):
+            get_did(scope=archive, name=dsns[1]['name'])
@@ -21,14 +21,16 @@
 
 import datetime
 import logging
+import os
 import tempfile
 import unittest
+import zlib
 from re import match
 
 import pytest
 
 from rucio.common.exception import InvalidType
-from rucio.common.utils import md5, adler32, parse_did_filter_from_string
+from rucio.common.utils import md5, adler32, adler32_and_md5, parse_did_filter_from_string, is_archive
 from rucio.common.logging import formatted_logger
 
 
@@ -62,9 +64,23 @@ class TestUtils(unittest.TestCase):
         assert match('[a-fA-F0-9]', ret) is not None
         assert ret == '198d03ff'
 
+        # A file spanning several read blocks gives the checksum of the whole content
+        with tempfile.NamedTemporaryFile() as temp_file:
+            data = os.urandom(2 * 1024 * 1024 + 1234)
+            temp_file.write(data)
+            temp_file.flush()
+            assert adler32(temp_file.name) == '%08x' % zlib.adler32(data)
+
         with pytest.raises(Exception, match='FATAL - could not get Adler32 checksum of file no_file - \\[Errno 2\\] No such file or directory: \'no_file\''):
             adler32('no_file')
 
+    def test_utils_adler32_and_md5(self):
+        """(COMMON/UTILS): test calculating Adler32 and MD5 of a file in one read"""
+        assert adler32_and_md5(self.temp_file_1.name) == ('198d03ff', '31d50dd6285b9ff9f8611d0762265d04')
+
+        with pytest.raises(Exception, match='FATAL - could not get Adler32 and MD5 checksums of file no_file'):
+            adler32_and_md5('no_file')
+
     def test_parse_did_filter_string(self):
         """(COMMON/UTILS): test parsing of did filter string"""
         test_cases = [{
@@ -102,3 +118,11 @@ def test_formatted_logger():
 
     new_log_func(logging.INFO, "b")
     assert result == (logging.INFO, "a b c")
+
+
+def test_is_archive():
+    """(COMMON/UTILS): test the detection of archive file names"""
+    for name in ('file.zip', 'file.ZIP', 'file.tar.gz', 'file.tgz.1', 'file.tar.Z', 'file.tar.bz2.2.3', 'file.tbz2', 'file.zipx'):
+        assert is_archive(name), name
+    for name in ('file', 'file.txt', 'file.zip.', 'file.zip.txt', 'file.gz', 'file.1'):
+        assert not is_archive(name), name